@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""Redaction throughput benchmark suite
+
+Runs filter_datum, Redactor.redact with its prefilter on and off,
+RedactingFormatter.format and the full get_logger() pipeline over
+synthetic log lines, varying one of message size, number of fields,
+match density and separator at a time around a baseline case.
+Reports lines/sec and peak traced allocations, and can write the results
+as JSON and compare them with a previous run:
+
+    ./bench_redaction.py --output HEAD.json --compare BASE.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import time
+import timeit
+import tracemalloc
+from typing import Callable, Dict, List
+from filtered_logger import (PII_FIELDS, RedactingFormatter, Redactor,
+                             filter_datum, get_logger)
+
+BASELINE = {'size': 256, 'fields': 5, 'density': 0.1, 'separator': ';'}
+VARIATIONS = {
+    'size': (64, 256, 1024, 4096),
+    'fields': (1, 5, 20),
+    'density': (0.0, 0.01, 0.1, 0.5, 1.0),
+    'separator': (';', '|'),
+}
+
+
+def make_fields(count: int) -> List[str]:
+    """ Returns count field names, starting with PII_FIELDS """
+    return (list(PII_FIELDS) + [f'secret{i}' for i in range(count)])[:count]
+
+
+def make_lines(count: int, size: int, fields: List[str], density: float,
+               separator: str, seed: int = 0) -> List[str]:
+    """ Returns count `k=v<separator>` lines of about size characters, of
+        which a density share carries a value for every field
+    """
+    rand = random.Random(seed)
+    lines = []
+    for _ in range(count):
+        pairs = []
+        if rand.random() < density:
+            pairs = [f'{field}=v{rand.randrange(10 ** 6)}{separator}'
+                     for field in fields]
+        length = sum(len(pair) for pair in pairs)
+        while length < size:
+            pair = f'key{len(pairs)}=value{rand.randrange(10 ** 6)}' \
+                   f'{separator}'
+            pairs.append(pair)
+            length += len(pair)
+        rand.shuffle(pairs)
+        lines.append(' '.join(pairs))
+    return lines
+
+
+def make_targets(fields: List[str], separator: str,
+                 lines: List[str]) -> Dict[str, Callable]:
+    """ Returns the benchmarked callables, each processing every line """
+    formatter = RedactingFormatter(fields)
+    formatter.redactor = Redactor(fields, formatter.REDACTION, separator)
+    records = [logging.makeLogRecord({'name': 'user_data', 'msg': line,
+                                      'levelno': logging.INFO,
+                                      'levelname': 'INFO'})
+               for line in lines]
+    logger = get_logger()
+    for handler in logger.handlers:
+        handler.setFormatter(formatter)
+    fmt = formatter.format
+    prefiltered = formatter.redactor.redact
+    unfiltered = Redactor(fields, formatter.REDACTION, separator,
+                          prefilter=False).redact
+
+    def run_filter_datum():
+        for line in lines:
+            filter_datum(fields, '***', line, separator)
+
+    def run_prefiltered():
+        for line in lines:
+            prefiltered(line)
+
+    def run_unfiltered():
+        for line in lines:
+            unfiltered(line)
+
+    def run_format():
+        for record in records:
+            fmt(record)
+
+    def run_logger():
+        for line in lines:
+            logger.info(line)
+
+    return {'filter_datum': run_filter_datum,
+            'Redactor.redact prefilter=on': run_prefiltered,
+            'Redactor.redact prefilter=off': run_unfiltered,
+            'RedactingFormatter.format': run_format,
+            'get_logger': run_logger}
+
+
+def measure(func: Callable, count: int, repeat: int) -> Dict[str, float]:
+    """ Returns the best lines/sec over repeat runs, and the peak traced
+        allocations of one run
+    """
+    best = min(timeit.repeat(func, number=1, repeat=repeat))
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'lines_per_sec': count / best, 'peak_bytes': peak}
+
+
+def run_suite(count: int, repeat: int) -> List[Dict]:
+    """ Runs every variation of every dimension against every target """
+    logger = get_logger()
+    devnull = open(os.devnull, 'w')
+    for handler in logger.handlers:
+        if isinstance(handler, logging.StreamHandler):
+            handler.setStream(devnull)
+    results = []
+    for dimension, values in VARIATIONS.items():
+        for value in values:
+            case = dict(BASELINE, **{dimension: value})
+            fields = make_fields(case['fields'])
+            lines = make_lines(count, case['size'], fields,
+                               case['density'], case['separator'])
+            targets = make_targets(fields, case['separator'], lines)
+            for target, func in targets.items():
+                result = dict(case, dimension=dimension, target=target)
+                result.update(measure(func, count, repeat))
+                results.append(result)
+                print(format_result(result))
+    devnull.close()
+    return results
+
+
+def result_key(result: Dict) -> str:
+    """ Returns the identifier of a result across runs """
+    return '{target} size={size} fields={fields} density={density} ' \
+           'sep={separator}'.format(**result)
+
+
+def format_result(result: Dict, previous: Dict = None) -> str:
+    """ Returns a one-line report of a result """
+    line = '{:<70} {:>12,.0f} lines/s {:>10,} B'.format(
+        result_key(result), result['lines_per_sec'], result['peak_bytes'])
+    if previous is not None:
+        change = result['lines_per_sec'] / previous['lines_per_sec'] - 1
+        line += f' {change:+.1%}'
+    return line
+
+
+def git_revision() -> str:
+    """ Returns the current commit, if any """
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    """ Runs the suite from the command line """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lines', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='write the results as JSON')
+    parser.add_argument('--compare', help='JSON results of a previous run')
+    args = parser.parse_args()
+
+    results = run_suite(args.lines, args.repeat)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'revision': git_revision(),
+                       'python': platform.python_version(),
+                       'timestamp': time.time(),
+                       'lines': args.lines,
+                       'results': results}, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            previous = {result_key(result): result
+                        for result in json.load(f)['results']}
+        print(f'\ncompared with {args.compare}:')
+        for result in results:
+            print(format_result(result, previous.get(result_key(result))))
+
+
+if __name__ == '__main__':
+    main()
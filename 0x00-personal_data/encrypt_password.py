@@ -1,13 +1,99 @@
 #!/usr/bin/env python3
 '''Password Hashing module'''
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, Tuple
 import bcrypt
 
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', 12))
+MIN_ROUNDS = 4
+MAX_ROUNDS = 31
 
-def hash_password(password: str) -> bytes:
-    '''hash pass function'''
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+
+def hash_password(password: str, rounds: int = None) -> bytes:
+    '''hash pass function, using BCRYPT_ROUNDS unless rounds is given'''
+    salt = bcrypt.gensalt(rounds or BCRYPT_ROUNDS)
+    return bcrypt.hashpw(password.encode('utf-8'), salt)
 
 
 def is_valid(hashed_password: bytes, password: str) -> bool:
     '''is valid function'''
     return bcrypt.checkpw(password.encode('utf-8'), hashed_password)
+
+
+def hash_rounds(hashed_password: bytes) -> int:
+    '''returns the cost a bcrypt hash was made with'''
+    return int(hashed_password.split(b'$')[2])
+
+
+def needs_rehash(hashed_password: bytes, rounds: int = None) -> bool:
+    '''tells if a hash was made with a lower cost than the configured one'''
+    return hash_rounds(hashed_password) < (rounds or BCRYPT_ROUNDS)
+
+
+def benchmark_rounds(rounds: int, samples: int = 3) -> float:
+    '''returns the best time in seconds of one hash at the given cost'''
+    best = None
+    for _ in range(samples):
+        start = time.perf_counter()
+        bcrypt.hashpw(b'calibration', bcrypt.gensalt(rounds))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def calibrate_rounds(target_ms: float = 250,
+                     min_rounds: int = 10,
+                     max_rounds: int = MAX_ROUNDS) -> Tuple[int, Dict]:
+    '''picks the highest cost whose hash stays under target_ms on this
+    machine, along with the measured {rounds: milliseconds}.
+    Each extra round doubles the work, so measuring stops as soon as the
+    next cost is predicted to go over budget.'''
+    timings = {}
+    rounds = max(min_rounds, MIN_ROUNDS)
+    timings[rounds] = benchmark_rounds(rounds) * 1000
+    while rounds < max_rounds and timings[rounds] * 2 <= target_ms:
+        rounds += 1
+        timings[rounds] = benchmark_rounds(rounds) * 1000
+    if timings[rounds] > target_ms and rounds > max(min_rounds, MIN_ROUNDS):
+        rounds -= 1
+    return rounds, timings
+
+
+def _ordered_map(func: Callable, items: Iterable,
+                 workers: int = None) -> Iterator:
+    '''maps func over items on a thread pool (bcrypt releases the GIL),
+    yielding results in input order with a bounded number in flight'''
+    workers = workers or os.cpu_count() or 1
+    window = workers * 4
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for item in items:
+            if len(pending) >= window:
+                yield pending.popleft().result()
+            pending.append(executor.submit(func, item))
+        while pending:
+            yield pending.popleft().result()
+
+
+def hash_passwords(passwords: Iterable[str],
+                   workers: int = None) -> Iterator[bytes]:
+    '''hashes many passwords in parallel, in input order'''
+    return _ordered_map(hash_password, passwords, workers)
+
+
+def verify_many(pairs: Iterable[Tuple[bytes, str]],
+                workers: int = None) -> Iterator[bool]:
+    '''checks many (hashed_password, password) pairs in parallel,
+    in input order'''
+    return _ordered_map(lambda pair: is_valid(*pair), pairs, workers)
+
+
+if __name__ == '__main__':
+    target = float(os.getenv('BCRYPT_TARGET_MS', 250))
+    chosen, measured = calibrate_rounds(target)
+    for cost, ms in sorted(measured.items()):
+        print(f'rounds={cost}: {ms:.1f} ms')
+    print(f'BCRYPT_ROUNDS={chosen}')
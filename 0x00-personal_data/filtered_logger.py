@@ -1,11 +1,28 @@
 #!/usr/bin/env python3
 """Logging to a secure file"""
+import hashlib
+import hmac
 import re
-from typing import List
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import (Any, Callable, Iterator, List, Mapping, Pattern,
+                    Sequence, Tuple)
+import atexit
+import json
 import logging
+import logging.handlers
 import os
+import queue
+import tempfile
+import threading
+import time
 import mysql.connector
 
+_RECORD_ATTRIBUTES = frozenset(logging.makeLogRecord({}).__dict__) | \
+    {'message', 'asctime', 'redacted'}
+
 
 class RedactingFormatter(logging.Formatter):
     """ Redacting Formatter class """
@@ -14,26 +31,181 @@ class RedactingFormatter(logging.Formatter):
     FORMAT = "[HOLBERTON] %(name)s %(levelname)s %(asctime)-15s: %(message)s"
     SEPARATOR = ";"
 
-    def __init__(self, fields: List[str]):
-        """ Constructor """
+    def __init__(self, fields: List[str],
+                 tokenizer: Callable[[str], str] = None):
+        """ Constructor, values are replaced by tokenizer(value) instead of
+            REDACTION when a tokenizer is given
+        """
         super(RedactingFormatter, self).__init__(self.FORMAT)
         self.fields = fields
+        self.redactor = Redactor(fields, self.REDACTION, self.SEPARATOR,
+                                 tokenizer=tokenizer)
 
     def format(self, record: logging.LogRecord) -> str:
-        """ Redacting Formatter """
-        return filter_datum(self.fields, self.REDACTION,
-                            super().format(record), self.SEPARATOR)
+        """ Redacting Formatter
+
+            Records logged with `extra={'redacted': True}` were already
+            redacted by their producer and are not scanned again.
+            Structured payloads (a dict/list message, args or `extra`
+            values) are masked by key before serialization, and a record
+            whose message is such a payload is not scanned either: its
+            string values are scanned one by one instead.
+        """
+        structured = isinstance(record.msg, (Mapping, list))
+        message = super().format(self._redact_payloads(record))
+        if structured or getattr(record, 'redacted', False):
+            return message
+        return self.redactor.redact(message)
+
+    def _redact_payloads(self, record: logging.LogRecord
+                         ) -> logging.LogRecord:
+        """ Returns the record, or a copy of it with its structured
+            payloads masked by key, their strings being scanned only when
+            the formatted message won't be
+        """
+        redactor = self.redactor
+        scan = isinstance(record.msg, (Mapping, list))
+        changes = {}
+        if isinstance(record.msg, (Mapping, list, tuple)):
+            changes['msg'] = redactor.redact_structure(record.msg, scan)
+        if record.args:
+            changes['args'] = redactor.redact_structure(record.args, scan)
+        for key in record.__dict__.keys() - _RECORD_ATTRIBUTES:
+            if key in redactor.keys:
+                changes[key] = redactor.mask(record.__dict__[key])
+            else:
+                changes[key] = redactor.redact_structure(
+                    record.__dict__[key], scan)
+        if not changes:
+            return record
+        record = logging.makeLogRecord(record.__dict__)
+        record.__dict__.update(changes)
+        return record
+
+
+@lru_cache(maxsize=128)
+def _compile_fields(fields: Tuple[str, ...], separator: str) -> Pattern:
+    """ Compiles every field into one alternation pattern so a message
+        is scanned once whatever the number of fields.
+    """
+    alternation = '|'.join(re.escape(field) for field in fields)
+    sep = re.escape(separator)
+    return re.compile(f'({alternation})=(.*?){sep}')
+
+
+class HmacTokenizer:
+    """ Tokenization strategy replacing a value by a keyed HMAC of it, so
+        equal values give equal tokens that can be correlated but not
+        reversed without the key. A bounded LRU cache spares rehashing
+        values logged over and over.
+    """
+
+    def __init__(self, key: bytes, cache_size: int = 4096,
+                 length: int = 16, prefix: str = 'tok_'):
+        """ Constructor """
+        self.key = key
+        self.length = length
+        self.prefix = prefix
+        self.tokenize = lru_cache(maxsize=cache_size)(self._hmac)
+
+    def _hmac(self, value: str) -> str:
+        """ Returns the token of a value """
+        digest = hmac.new(self.key, value.encode('utf-8'), hashlib.sha256)
+        return self.prefix + digest.hexdigest()[:self.length]
+
+    def __call__(self, value: str) -> str:
+        """ Returns the token of a value, from the cache when possible """
+        return self.tokenize(value)
+
+
+class Redactor:
+    """ Single-pass redaction engine for a fixed set of fields """
+
+    def __init__(self, fields: Sequence[str], redaction: str,
+                 separator: str, prefilter: bool = True,
+                 tokenizer: Callable[[str], str] = None):
+        """ Constructor, values are replaced by tokenizer(value) instead of
+            redaction when a tokenizer is given
+        """
+        self.fields = tuple(fields)
+        self.keys = frozenset(self.fields)
+        self.redaction = redaction
+        self.separator = separator
+        self.prefilter = prefilter
+        self.tokenizer = tokenizer
+        self._tokens = tuple(f'{field}=' for field in self.fields)
+        self._pattern = _compile_fields(self.fields, separator) \
+            if self.fields else None
+        if tokenizer is None:
+            tail = f'={redaction}{separator}'.replace('\\', '\\\\')
+            self._replacement = '\\g<1>' + tail
+        else:
+            self._replacement = self._tokenize_match
+
+    def _tokenize_match(self, match: re.Match) -> str:
+        """ Returns the tokenized replacement of a `field=value` match """
+        return f'{match.group(1)}={self.tokenizer(match.group(2))}' \
+               f'{self.separator}'
+
+    def mask(self, value: Any) -> Any:
+        """ Returns what replaces the value of a field """
+        if self.tokenizer is None:
+            return self.redaction
+        return self.tokenizer(str(value))
+
+    def redact(self, message: str) -> str:
+        """ Returns the message with every field value redacted
+
+            With the prefilter on, a message containing none of the
+            `field=` tokens is returned as is without running the regex:
+            a few substring searches cost far less than a regex scan.
+        """
+        if self._pattern is None:
+            return message
+        if self.prefilter:
+            for token in self._tokens:
+                if token in message:
+                    break
+            else:
+                return message
+        return self._pattern.sub(self._replacement, message)
+
+    def redact_structure(self, payload: Any, scan: bool = True) -> Any:
+        """ Returns a copy of a dict/list payload where the values of the
+            fields are redacted, walking it by key instead of scanning its
+            serialized form. With scan, the strings it holds under other
+            keys go through redact(), so its serialized form needs no scan
+        """
+        if isinstance(payload, Mapping):
+            return {key: self.mask(value) if key in self.keys
+                    else self.redact_structure(value, scan)
+                    for key, value in payload.items()}
+        if isinstance(payload, list):
+            return [self.redact_structure(value, scan) for value in payload]
+        if isinstance(payload, tuple):
+            return tuple(self.redact_structure(value, scan)
+                         for value in payload)
+        if scan and isinstance(payload, str):
+            return self.redact(payload)
+        return payload
+
+
+@lru_cache(maxsize=128)
+def _get_redactor(fields: Tuple[str, ...], redaction: str,
+                  separator: str,
+                  tokenizer: Callable[[str], str] = None) -> Redactor:
+    """ Returns a cached Redactor for the given settings """
+    return Redactor(fields, redaction, separator, tokenizer=tokenizer)
 
 
 def filter_datum(fields: List[str], redaction: str, message: str,
-                 separator: str) -> str:
+                 separator: str,
+                 tokenizer: Callable[[str], str] = None) -> str:
     """ Returns a message with the given fields redacted with the specified
-        redaction string.
+        redaction string, or tokenized by tokenizer when one is given.
     """
-    for field in fields:
-        message = re.sub(f'{field}=(.*?){separator}',
-                         f'{field}={redaction}{separator}', message)
-    return message
+    redactor = _get_redactor(tuple(fields), redaction, separator, tokenizer)
+    return redactor.redact(message)
 
 
 def get_db() -> mysql.connector.connection.MySQLConnection:
@@ -47,39 +219,384 @@ def get_db() -> mysql.connector.connection.MySQLConnection:
     return connection
 
 
+class ConnectionPool:
+    ''' Thread-safe pool of at most `size` database connections
+
+        Idle connections older than `idle_timeout` seconds are closed, and
+        every connection is health checked before being handed out.
+    '''
+
+    def __init__(self, connect: Callable = get_db, size: int = 5,
+                 idle_timeout: float = 300.0):
+        ''' Constructor '''
+        self._connect = connect
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self._idle = deque()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+
+    @staticmethod
+    def _is_healthy(connection) -> bool:
+        ''' tells if a connection can still be used '''
+        try:
+            return connection.is_connected()
+        except Exception:
+            return False
+
+    @staticmethod
+    def _discard(connection) -> None:
+        ''' closes a connection, ignoring errors of a dead one '''
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def _pop_expired(self) -> list:
+        ''' removes the idle connections past their timeout '''
+        expired = []
+        deadline = time.monotonic() - self.idle_timeout
+        with self._lock:
+            while self._idle and self._idle[0][1] < deadline:
+                expired.append(self._idle.popleft()[0])
+        return expired
+
+    def acquire(self):
+        ''' checks out a healthy connection, opening one if none is idle,
+            and waits while `size` connections are already checked out
+        '''
+        self._slots.acquire()
+        try:
+            for connection in self._pop_expired():
+                self._discard(connection)
+            while True:
+                with self._lock:
+                    if not self._idle:
+                        break
+                    connection = self._idle.pop()[0]
+                if self._is_healthy(connection):
+                    return connection
+                self._discard(connection)
+            return self._connect()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, connection) -> None:
+        ''' returns a checked out connection to the pool '''
+        with self._lock:
+            self._idle.append((connection, time.monotonic()))
+        self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        ''' context manager checking a connection out and back in '''
+        connection = self.acquire()
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def close(self) -> None:
+        ''' closes every idle connection '''
+        with self._lock:
+            idle, self._idle = self._idle, deque()
+        for connection, _ in idle:
+            self._discard(connection)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_db_pool() -> ConnectionPool:
+    ''' returns the process-wide pool of get_db connections, sized by
+        PERSONAL_DATA_DB_POOL_SIZE and PERSONAL_DATA_DB_POOL_IDLE_TIMEOUT
+    '''
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(
+                get_db,
+                int(os.getenv('PERSONAL_DATA_DB_POOL_SIZE', 5)),
+                float(os.getenv('PERSONAL_DATA_DB_POOL_IDLE_TIMEOUT', 300))
+            )
+            atexit.register(_pool.close)
+    return _pool
+
+
 PII_FIELDS = ('name', 'email', 'phone', 'ssn', 'password')
 
 
-def get_logger() -> logging.Logger:
-    ''' get_logger method '''
+def get_tokenizer() -> HmacTokenizer:
+    ''' returns a tokenizer keyed by PERSONAL_DATA_TOKEN_KEY, or None when
+        it isn't set and values are masked by REDACTION instead
+    '''
+    token_key = os.getenv('PERSONAL_DATA_TOKEN_KEY')
+    return HmacTokenizer(token_key.encode()) if token_key else None
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    ''' QueueHandler applying an overflow policy once its queue is full:
+        `block` waits for room, `drop` discards the record and `count`
+        discards it and increments `dropped`
+    '''
+
+    OVERFLOW_POLICIES = ('block', 'drop', 'count')
+
+    def __init__(self, log_queue: queue.Queue, overflow: str = 'block'):
+        ''' Constructor '''
+        if overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError(f'unknown overflow policy: {overflow}')
+        super().__init__(log_queue)
+        self.overflow = overflow
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        ''' hands the record over untouched: the listener lives in this
+            process, so its payloads are still redacted by key on the
+            worker instead of being merged into the message here
+        '''
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        ''' puts the record on the queue according to the policy '''
+        if self.overflow == 'block':
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if self.overflow == 'count':
+                self.dropped += 1
+
+
+class DrainingQueueListener(logging.handlers.QueueListener):
+    ''' QueueListener whose stop waits for room in a full queue, so every
+        accepted record is written before the worker exits
+    '''
+
+    def enqueue_sentinel(self) -> None:
+        ''' blocks until the stop sentinel fits in the queue '''
+        self.queue.put(self._sentinel)
+
+
+_listener = None
+
+
+def get_logger(async_mode: bool = None, queue_size: int = None,
+               overflow: str = None) -> logging.Logger:
+    ''' get_logger method
+
+        In async mode records go through a bounded queue and are redacted
+        and written by a background QueueListener. The logger is only
+        configured once, later calls return it unchanged.
+    '''
+    global _listener
     logger = logging.getLogger('user_data')
     logger.setLevel(logging.INFO)
     logger.propagate = False
+    if logger.handlers:
+        return logger
+
+    if async_mode is None:
+        async_mode = os.getenv('PERSONAL_DATA_LOG_ASYNC', '').lower() in \
+            ('1', 'true', 'yes')
 
     stream_handler = logging.StreamHandler()
     stream_handler.setLevel(logging.INFO)
-    formatter = RedactingFormatter(list(PII_FIELDS))
+    formatter = RedactingFormatter(list(PII_FIELDS), get_tokenizer())
     stream_handler.setFormatter(formatter)
 
-    logger.addHandler(stream_handler)
+    if not async_mode:
+        logger.addHandler(stream_handler)
+        return logger
+
+    if queue_size is None:
+        queue_size = int(os.getenv('PERSONAL_DATA_LOG_QUEUE_SIZE', 10000))
+    if overflow is None:
+        overflow = os.getenv('PERSONAL_DATA_LOG_OVERFLOW', 'block')
+    log_queue = queue.Queue(queue_size)
+    queue_handler = BoundedQueueHandler(log_queue, overflow)
+    queue_handler.setLevel(logging.INFO)
+    _listener = DrainingQueueListener(log_queue, stream_handler,
+                                      respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    logger.addHandler(queue_handler)
     return logger
 
 
+class RowRedactor:
+    ''' Redacts tabular rows by column position: the columns to mask are
+        resolved once from the headers, so no line is ever regex-scanned.
+        Values are replaced by tokenizer(str(value)) instead of redaction
+        when a tokenizer is given
+    '''
+
+    def __init__(self, headers: Sequence[str], fields: Sequence[str],
+                 redaction: str, tokenizer: Callable[[str], str] = None):
+        ''' Constructor '''
+        self.headers = tuple(headers)
+        self.tokenizer = tokenizer
+        self._columns = tuple(
+            (f'{x}={redaction}; ' if tokenizer is None else f'{x}=', True)
+            if x in fields else (f'{x}=', False) for x in self.headers)
+
+    def redact(self, row: Sequence) -> str:
+        ''' builds the redacted `k=v; ` line of a row '''
+        tokenizer = self.tokenizer
+        if tokenizer is None:
+            return ''.join([column if masked else f'{column}{z}; '
+                            for (column, masked), z in zip(self._columns,
+                                                           row)])
+        return ''.join([f'{column}{tokenizer(str(z)) if masked else z}; '
+                        for (column, masked), z in zip(self._columns, row)])
+
+
+def iter_rows(cursor, batch_size: int) -> Iterator[Tuple]:
+    ''' yields the rows of an executed cursor batch_size rows at a time,
+        so only one batch is ever held in memory
+    '''
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield from rows
+
+
+def export_rows(cursor, logger: logging.Logger, batch_size: int = None,
+                tokenizer: Callable[[str], str] = None) -> None:
+    ''' logs every row of an executed cursor, streaming it in batches
+        when batch_size is given. PII columns are masked by position, or
+        tokenized when a tokenizer is given
+    '''
+    headers = [i[0] for i in cursor.description]
+    redactor = RowRedactor(headers, PII_FIELDS, RedactingFormatter.REDACTION,
+                           tokenizer)
+    rows = cursor if batch_size is None else iter_rows(cursor, batch_size)
+    for row in rows:
+        logger.info(redactor.redact(row), extra={'redacted': True})
+
+
+def key_ranges(cursor, shards: int, key: str = 'id') -> List[Tuple]:
+    ''' splits the integer key space of users into at most shards
+        [low, high) ranges
+    '''
+    if not key.isidentifier():
+        raise ValueError(f'invalid key column: {key}')
+    cursor.execute(f"SELECT MIN({key}), MAX({key}) FROM users")
+    low, high = cursor.fetchone()
+    if low is None:
+        return []
+    step = -(-(high - low + 1) // shards)
+    return [(start, min(start + step, high + 1))
+            for start in range(low, high + 1, step)]
+
+
+def export_shard(low: int, high: int, key: str, path: str,
+                 batch_size: int = 1000, formatted: bool = True) -> int:
+    ''' exports the users rows with low <= key < high on its own
+        connection to path, one line per row, and returns the row count.
+        Lines are fully formatted, or else just redacted and JSON encoded
+        to be logged later
+    '''
+    db = get_db()
+    try:
+        cursor = db.cursor(buffered=False)
+        cursor.execute(f"SELECT * FROM users WHERE {key} >= %s "
+                       f"AND {key} < %s ORDER BY {key}", (low, high))
+        headers = [i[0] for i in cursor.description]
+        redactor = RowRedactor(headers, PII_FIELDS,
+                               RedactingFormatter.REDACTION, get_tokenizer())
+        formatter = RedactingFormatter(list(PII_FIELDS))
+        result = 0
+        with open(path, 'w') as f:
+            for row in iter_rows(cursor, batch_size):
+                line = redactor.redact(row)
+                if formatted:
+                    line = formatter.format(logging.makeLogRecord({
+                        'name': 'user_data', 'levelno': logging.INFO,
+                        'levelname': 'INFO', 'msg': line, 'redacted': True}))
+                else:
+                    line = json.dumps(line)
+                f.write(line + '\n')
+                result += 1
+        cursor.close()
+    finally:
+        db.close()
+    return result
+
+
+def export_sharded(shards: int, key: str = 'id', output_dir: str = None,
+                   workers: int = None, batch_size: int = 1000) -> None:
+    ''' exports users split in key ranges processed by a process pool
+
+        Each shard is written to its own file. With output_dir they are
+        listed in output_dir/manifest.json, otherwise they are spooled to
+        a temporary directory and logged in key order through
+        get_logger() as each one completes, so no shard is held in
+        memory.
+    '''
+    db = get_db()
+    try:
+        cursor = db.cursor()
+        ranges = key_ranges(cursor, shards, key)
+        cursor.close()
+    finally:
+        db.close()
+    if output_dir is None:
+        spool = tempfile.TemporaryDirectory(prefix='users_export_')
+        directory = spool.name
+    else:
+        os.makedirs(output_dir, exist_ok=True)
+        directory = output_dir
+    paths = [os.path.join(directory, f'users.{i:04d}.log')
+             for i in range(len(ranges))]
+    lows, highs = [r[0] for r in ranges], [r[1] for r in ranges]
+    with ProcessPoolExecutor(workers) as executor:
+        results = executor.map(export_shard, lows, highs,
+                               [key] * len(ranges), paths,
+                               [batch_size] * len(ranges),
+                               [output_dir is not None] * len(ranges))
+        if output_dir is None:
+            logger = get_logger()
+            with spool:
+                for path, _ in zip(paths, results):
+                    with open(path) as f:
+                        for line in f:
+                            logger.info(json.loads(line),
+                                        extra={'redacted': True})
+                    os.remove(path)
+            return
+        manifest = {'table': 'users', 'key': key, 'shards': [
+            {'low': low, 'high': high, 'path': os.path.basename(path),
+             'rows': rows}
+            for low, high, path, rows in zip(lows, highs, paths, results)]}
+    with open(os.path.join(output_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+
 def main() -> None:
     ''' main method '''
-    db = get_db()
-    cursor = db.cursor()
-    cursor.execute("SELECT * FROM users")
-    logger = get_logger()
-    headers = [i[0] for i in cursor.description]
-    for row in cursor:
-        row_str = ''
-        for x, z in zip(headers, row):
-            row_str += f'{x}={z}; '
-        logger.info(row_str)
-
-    cursor.close()
-    db.close()
+    stream = os.getenv('PERSONAL_DATA_EXPORT_STREAM', '').lower() in \
+        ('1', 'true', 'yes')
+    batch_size = int(os.getenv('PERSONAL_DATA_EXPORT_BATCH_SIZE', 1000))
+    shards = int(os.getenv('PERSONAL_DATA_EXPORT_SHARDS', 0))
+    if shards > 0:
+        export_sharded(shards, os.getenv('PERSONAL_DATA_EXPORT_KEY', 'id'),
+                       os.getenv('PERSONAL_DATA_EXPORT_DIR'),
+                       batch_size=batch_size)
+        return
+    with get_db_pool().connection() as db:
+        cursor = db.cursor(buffered=False) if stream else db.cursor()
+        cursor.execute("SELECT * FROM users")
+        logger = get_logger()
+        export_rows(cursor, logger, batch_size if stream else None,
+                    get_tokenizer())
+
+        cursor.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""Scrub PII from existing log files with the filter_datum engine
+
+Each input is memory-mapped and cut into chunks ending on line
+boundaries, the chunks are redacted by a process pool and written back in
+order, so no file is ever loaded whole into memory:
+
+    ./scrub_logs.py app.log app.log.1 --output-dir scrubbed/
+"""
+import argparse
+import mmap
+import os
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Tuple
+from filtered_logger import PII_FIELDS, RedactingFormatter, Redactor
+
+CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def chunk_bounds(mm: mmap.mmap, chunk_size: int) -> Iterator[Tuple]:
+    """ Yields (start, end) offsets of chunks of about chunk_size bytes,
+        each ending right after a newline or at the end of the file
+    """
+    size = len(mm)
+    start = 0
+    while start < size:
+        end = mm.find(b'\n', min(start + chunk_size, size) - 1)
+        end = size if end == -1 else end + 1
+        yield start, end
+        start = end
+
+
+def scrub_chunk(path: str, start: int, end: int, fields: Tuple,
+                redaction: str, separator: str) -> bytes:
+    """ Returns the redacted bytes of the [start, end) chunk of path """
+    redactor = Redactor(fields, redaction, separator)
+    with open(path, 'rb') as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        text = mm[start:end].decode('utf-8', 'surrogateescape')
+    return redactor.redact(text).encode('utf-8', 'surrogateescape')
+
+
+def scrub_file(executor: ProcessPoolExecutor, path: str, output: str,
+               fields: Tuple, redaction: str, separator: str,
+               chunk_size: int = CHUNK_SIZE, window: int = 8) -> int:
+    """ Writes the redacted copy of path to output, with at most window
+        chunks in flight, and returns the number of chunks
+
+        The copy goes to a temporary file with the mode of path, renamed
+        to output once complete, so output may be path itself, which is
+        then scrubbed in place.
+    """
+    chunks = 0
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(output)),
+        prefix=os.path.basename(output) + '.', suffix='.tmp')
+    try:
+        with open(path, 'rb') as f, open(fd, 'wb') as out:
+            if os.fstat(f.fileno()).st_size > 0:
+                with mmap.mmap(f.fileno(), 0,
+                               access=mmap.ACCESS_READ) as mm:
+                    pending = deque()
+                    for start, end in chunk_bounds(mm, chunk_size):
+                        if len(pending) >= window:
+                            out.write(pending.popleft().result())
+                        pending.append(executor.submit(
+                            scrub_chunk, path, start, end, fields,
+                            redaction, separator))
+                        chunks += 1
+                    while pending:
+                        out.write(pending.popleft().result())
+        os.chmod(tmp_path, os.stat(path).st_mode & 0o777)
+        os.replace(tmp_path, output)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return chunks
+
+
+def output_path(path: str, output_dir: str, suffix: str) -> str:
+    """ Returns where the redacted copy of path goes """
+    if output_dir is None:
+        return path + suffix
+    return os.path.join(output_dir, os.path.basename(path))
+
+
+def main(argv: List[str] = None) -> None:
+    """ Scrubs the files given on the command line """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('inputs', nargs='+', help='log files to scrub')
+    parser.add_argument('--output-dir',
+                        help='write scrubbed files here under their name '
+                             'instead of next to the inputs')
+    parser.add_argument('--suffix', default='.scrubbed')
+    parser.add_argument('--fields', default=','.join(PII_FIELDS),
+                        help='comma-separated fields to redact')
+    parser.add_argument('--redaction', default=RedactingFormatter.REDACTION)
+    parser.add_argument('--separator', default=RedactingFormatter.SEPARATOR)
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                        help='bytes per chunk')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    fields = tuple(field for field in args.fields.split(',') if field)
+    if args.output_dir is not None:
+        os.makedirs(args.output_dir, exist_ok=True)
+    with ProcessPoolExecutor(args.workers) as executor:
+        window = 2 * (args.workers or os.cpu_count() or 1)
+        for path in args.inputs:
+            output = output_path(path, args.output_dir, args.suffix)
+            chunks = scrub_file(executor, path, output, fields,
+                                args.redaction, args.separator,
+                                args.chunk_size, window)
+            print(f'{path} -> {output} ({chunks} chunks)')
+
+
+if __name__ == '__main__':
+    main()
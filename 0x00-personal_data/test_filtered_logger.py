@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""Unit tests of filtered_logger"""
+import io
+import logging
+import sqlite3
+import sys
+import threading
+import time
+import types
+import unittest
+
+try:
+    import mysql.connector
+except ImportError:
+    mysql = types.ModuleType('mysql')
+    mysql.connector = types.ModuleType('mysql.connector')
+    mysql.connector.connection = types.SimpleNamespace(MySQLConnection=None)
+    sys.modules['mysql'] = mysql
+    sys.modules['mysql.connector'] = mysql.connector
+
+import filtered_logger  # noqa: E402
+
+
+class CountingCursor:
+    """ sqlite3 cursor recording the size of every fetchmany call """
+
+    def __init__(self, cursor: sqlite3.Cursor):
+        """ Constructor """
+        self.cursor = cursor
+        self.fetches = []
+
+    @property
+    def description(self):
+        """ column descriptions of the executed query """
+        return self.cursor.description
+
+    def fetchmany(self, size: int) -> list:
+        """ fetches the next rows, recording how many were returned """
+        rows = self.cursor.fetchmany(size)
+        self.fetches.append(len(rows))
+        return rows
+
+    def __iter__(self):
+        """ iterates every remaining row """
+        return iter(self.cursor)
+
+
+class TestExportRows(unittest.TestCase):
+    """ export_rows over an in-memory SQLite cursor """
+
+    def setUp(self):
+        """ creates a users table and a logger writing to a buffer """
+        self.db = sqlite3.connect(':memory:')
+        self.db.execute('CREATE TABLE users (id INTEGER, name TEXT, '
+                        'email TEXT, last_login TEXT)')
+        self.db.executemany('INSERT INTO users VALUES (?, ?, ?, ?)',
+                            [(i, f'name{i}', f'user{i}@example.com',
+                              f'2019-11-14 06:{i:02d}:00')
+                             for i in range(1, 8)])
+        self.stream = io.StringIO()
+        handler = logging.StreamHandler(self.stream)
+        handler.setFormatter(
+            filtered_logger.RedactingFormatter(
+                list(filtered_logger.PII_FIELDS)))
+        self.logger = logging.getLogger('test_export_rows')
+        self.logger.propagate = False
+        self.logger.handlers = [handler]
+        self.logger.setLevel(logging.INFO)
+
+    def tearDown(self):
+        """ closes the database """
+        self.db.close()
+
+    def cursor(self) -> CountingCursor:
+        """ returns a cursor over every user """
+        return CountingCursor(self.db.execute('SELECT * FROM users '
+                                              'ORDER BY id'))
+
+    def messages(self) -> list:
+        """ returns the logged messages, without the log prefix """
+        return [line.split(': ', 1)[1]
+                for line in self.stream.getvalue().splitlines()]
+
+    def test_batches(self):
+        """ rows are fetched batch_size at a time and all logged """
+        cursor = self.cursor()
+        filtered_logger.export_rows(cursor, self.logger, batch_size=3)
+        self.assertEqual(cursor.fetches, [3, 3, 1, 0])
+        messages = self.messages()
+        self.assertEqual(len(messages), 7)
+        self.assertEqual(messages[0], 'id=1; name=***; email=***; '
+                                      'last_login=2019-11-14 06:01:00; ')
+
+    def test_without_batches(self):
+        """ without batch_size the cursor is iterated directly """
+        cursor = self.cursor()
+        filtered_logger.export_rows(cursor, self.logger)
+        self.assertEqual(cursor.fetches, [])
+        self.assertEqual(len(self.messages()), 7)
+
+    def test_batch_larger_than_table(self):
+        """ a batch larger than the table fetches it at once """
+        cursor = self.cursor()
+        filtered_logger.export_rows(cursor, self.logger, batch_size=100)
+        self.assertEqual(cursor.fetches, [7, 0])
+        self.assertEqual(len(self.messages()), 7)
+
+
+class FakeConnection:
+    """ connection whose health is set by the test """
+
+    def __init__(self):
+        """ Constructor """
+        self.connected = True
+        self.closed = False
+
+    def is_connected(self) -> bool:
+        """ tells if the connection is alive """
+        return self.connected and not self.closed
+
+    def close(self) -> None:
+        """ closes the connection """
+        self.closed = True
+
+
+class TestConnectionPool(unittest.TestCase):
+    """ ConnectionPool over a fake connector """
+
+    def setUp(self):
+        """ records every connection the connector opens """
+        self.opened = []
+
+    def connect(self) -> FakeConnection:
+        """ fake connector """
+        connection = FakeConnection()
+        self.opened.append(connection)
+        return connection
+
+    def test_reuse(self):
+        """ a released connection is handed out again """
+        pool = filtered_logger.ConnectionPool(self.connect, size=2)
+        with pool.connection() as first:
+            pass
+        with pool.connection() as second:
+            self.assertIs(second, first)
+        self.assertEqual(len(self.opened), 1)
+        self.assertFalse(first.closed)
+
+    def test_health_eviction(self):
+        """ a dead idle connection is closed and replaced """
+        pool = filtered_logger.ConnectionPool(self.connect, size=2)
+        with pool.connection() as first:
+            pass
+        first.connected = False
+        with pool.connection() as second:
+            self.assertIsNot(second, first)
+        self.assertTrue(first.closed)
+        self.assertEqual(len(self.opened), 2)
+
+    def test_idle_expiry(self):
+        """ a connection idle past idle_timeout is closed and replaced """
+        pool = filtered_logger.ConnectionPool(self.connect, size=2,
+                                              idle_timeout=0.05)
+        with pool.connection() as first:
+            pass
+        time.sleep(0.1)
+        with pool.connection() as second:
+            self.assertIsNot(second, first)
+        self.assertTrue(first.closed)
+        self.assertEqual(len(self.opened), 2)
+
+    def test_blocks_when_exhausted(self):
+        """ acquire waits until a checked out connection is released """
+        pool = filtered_logger.ConnectionPool(self.connect, size=1)
+        first = pool.acquire()
+        acquired = []
+        waiter = threading.Thread(target=lambda:
+                                  acquired.append(pool.acquire()))
+        waiter.start()
+        waiter.join(0.1)
+        self.assertTrue(waiter.is_alive())
+        self.assertEqual(acquired, [])
+        pool.release(first)
+        waiter.join(1)
+        self.assertFalse(waiter.is_alive())
+        self.assertEqual(acquired, [first])
+        self.assertEqual(len(self.opened), 1)
+
+    def test_close(self):
+        """ close closes every idle connection """
+        pool = filtered_logger.ConnectionPool(self.connect, size=2)
+        first, second = pool.acquire(), pool.acquire()
+        pool.release(first)
+        pool.release(second)
+        pool.close()
+        self.assertTrue(first.closed and second.closed)
+
+
+if __name__ == '__main__':
+    unittest.main()
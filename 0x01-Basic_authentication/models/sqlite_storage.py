@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+""" SQLite storage module
+"""
+from datetime import datetime
+from typing import Iterator, List, TypeVar
+import os
+import sqlite3
+import threading
+
+
+class SQLiteStorage():
+    """ Storage of the models in a SQLite database: one table per model
+    class, with a column per attribute declared in __slots__ and an index
+    on each of its indexed_attributes and sorted_attributes
+
+    Every save or remove writes its row right away. Each thread (and
+    process) gets its own connection; the database runs in WAL mode so
+    readers are not blocked by a writer.
+    """
+
+    def __init__(self, file_path: str, timestamp_format: str):
+        """ Initialize with the database file and the format timestamps
+        are stored in
+        """
+        self.file_path = file_path
+        self.timestamp_format = timestamp_format
+        self.tables = {}
+        self.local = threading.local()
+
+    def connection(self) -> sqlite3.Connection:
+        """ Return the connection of the current thread, opening it if
+        needed
+        """
+        pid = os.getpid()
+        if getattr(self.local, 'pid', None) != pid:
+            conn = sqlite3.connect(self.file_path, timeout=30,
+                                   isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+            self.local.pid = pid
+        return self.local.conn
+
+    def columns(self, cls) -> tuple:
+        """ Return the columns of the table of a class, creating the table
+        and its indexes if needed
+        """
+        s_class = cls.__name__
+        columns = self.tables.get(s_class)
+        if columns is None:
+            columns = cls._slot_names()
+            conn = self.connection()
+            conn.execute('CREATE TABLE IF NOT EXISTS "{}" ({})'.format(
+                s_class, ", ".join('"id" TEXT PRIMARY KEY' if col == 'id'
+                                   else '"{}"'.format(col)
+                                   for col in columns)))
+            for attr in cls.indexed_attributes + cls.sorted_attributes:
+                if attr != 'id' and attr in columns:
+                    conn.execute('CREATE INDEX IF NOT EXISTS "{0}_{1}" '
+                                 'ON "{0}" ("{1}")'.format(s_class, attr))
+            self.tables[s_class] = columns
+        return columns
+
+    def value(self, value):
+        """ Return a value as stored in a column
+        """
+        if type(value) is datetime:
+            return value.strftime(self.timestamp_format)
+        return value
+
+    def select(self, cls, where: str = "", params: tuple = ()) -> Iterator:
+        """ Iterate the objects of the rows of a class matching a WHERE
+        clause
+        """
+        columns = self.columns(cls)
+        cursor = self.connection().execute('SELECT {} FROM "{}" {}'.format(
+            ", ".join('"{}"'.format(col) for col in columns),
+            cls.__name__, where), params)
+        for row in cursor:
+            yield cls(**dict(zip(columns, row)))
+
+    def load(self, cls) -> int:
+        """ Prepare the table of a class and return its number of objects
+        """
+        self.columns(cls)
+        return self.count(cls)
+
+    def save(self, obj: TypeVar('Base')):
+        """ Insert or update the row of an object
+        """
+        self.save_many(obj.__class__, [obj])
+
+    def save_many(self, cls, objs: List[TypeVar('Base')]):
+        """ Insert or update the rows of many objects of a class, in one
+        transaction
+        """
+        columns = self.columns(cls)
+        quoted = ['"{}"'.format(col) for col in columns]
+        rows = []
+        for obj in objs:
+            obj_json = obj.to_json(True)
+            rows.append([self.value(obj_json.get(col)) for col in columns])
+        sql = 'INSERT INTO "{}" ({}) VALUES ({}) ON CONFLICT("id") DO ' \
+              'UPDATE SET {}'.format(
+                  cls.__name__, ", ".join(quoted),
+                  ", ".join("?" * len(columns)),
+                  ", ".join("{0} = excluded.{0}".format(col)
+                            for col in quoted[1:]))
+        conn = self.connection()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(sql, rows)
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def remove(self, obj: TypeVar('Base')):
+        """ Delete the row of an object
+        """
+        self.columns(obj.__class__)
+        self.connection().execute('DELETE FROM "{}" WHERE "id" = ?'.format(
+            obj.__class__.__name__), (obj.id,))
+
+    def count(self, cls) -> int:
+        """ Count the objects of a class
+        """
+        self.columns(cls)
+        return self.connection().execute('SELECT COUNT(*) FROM "{}"'.format(
+            cls.__name__)).fetchone()[0]
+
+    def get(self, cls, id: str) -> TypeVar('Base'):
+        """ Return one object by ID, or None
+        """
+        return next(self.select(cls, 'WHERE "id" = ?', (id,)), None)
+
+    def query(self, cls, attributes: dict, prefixes: dict, ranges: dict,
+              order_by: str, offset: int,
+              limit: int) -> Iterator[TypeVar('Base')]:
+        """ Iterate the objects matching the conditions of Base.query,
+        in insertion order unless order_by is given
+        """
+        columns = self.columns(cls)
+        conditions = []
+        params = []
+        for attr, value in attributes.items():
+            if attr not in columns:
+                if value is not None:
+                    return
+            elif value is None:
+                conditions.append('"{}" IS NULL'.format(attr))
+            else:
+                conditions.append('"{}" = ?'.format(attr))
+                params.append(self.value(value))
+        for attr, prefix in prefixes.items():
+            if attr not in columns:
+                return
+            conditions.append('"{}" >= ?'.format(attr))
+            params.append(prefix)
+            if prefix != "" and ord(prefix[-1]) < 0x10ffff:
+                conditions.append('"{}" < ?'.format(attr))
+                params.append(prefix[:-1] + chr(ord(prefix[-1]) + 1))
+        for attr, (low, high) in ranges.items():
+            if attr not in columns:
+                return
+            conditions.append('"{}" IS NOT NULL'.format(attr))
+            if low is not None:
+                conditions.append('"{}" >= ?'.format(attr))
+                params.append(self.value(low))
+            if high is not None:
+                conditions.append('"{}" <= ?'.format(attr))
+                params.append(self.value(high))
+        where = "WHERE " + " AND ".join(conditions) if conditions else ""
+
+        order = "rowid"
+        if order_by is not None:
+            descending = order_by[0] == "-"
+            attr = order_by[1:] if descending else order_by
+            direction = " DESC" if descending else ""
+            order = '"id"{}'.format(direction)
+            if attr in columns and attr != "id":
+                order = '"{}"{}, {}'.format(attr, direction, order)
+        params += [-1 if limit is None else limit, offset]
+        yield from self.select(cls, '{} ORDER BY {} LIMIT ? OFFSET ?'.format(
+            where, order), params)
+
+    def page(self, cls, after: str = None,
+             limit: int = None) -> Iterator[TypeVar('Base')]:
+        """ Iterate the objects ordered by ID, starting right after the ID
+        `after`, at most `limit` of them
+        """
+        where = 'WHERE "id" > ?' if after is not None else ""
+        params = (after,) if after is not None else ()
+        return self.select(cls, '{} ORDER BY "id" LIMIT ?'.format(where),
+                           params + (-1 if limit is None else limit,))
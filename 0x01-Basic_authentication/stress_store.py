@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+""" Multi-threaded, multi-process stress test of the DATA store: in each
+process writers save and remove their own users, and a resaver keeps
+saving a few hot users unchanged, while readers get, search and page
+through everyone's and must always find the hot users; then the file
+reloaded from disk must match the users every process holds in memory
+
+    ./stress_store.py [seconds] [threads per process] [processes]
+"""
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from models.base import flush
+from models.user import User
+
+HOT_USERS = 4
+HOT_SWITCH_INTERVAL = 1e-4
+
+
+class HotUser(User):
+    """ Users kept apart in a tiny store, so that a save spends most of
+    its time updating the indexes, where readers could catch it midway
+    """
+    __slots__ = ()
+
+
+def writer(seed: int, ids: list, deadline: float, errors: list):
+    """ Save new users, update or remove existing ones until deadline
+    """
+    rand = random.Random(seed)
+    try:
+        while time.monotonic() < deadline:
+            action = rand.random()
+            if action < 0.5 or not ids:
+                user = User()
+                user.email = "w{}-{}@example.com".format(seed, len(ids))
+                user.password = "pwd"
+                user.save()
+                ids.append(user.id)
+                continue
+            user = User.get(rand.choice(ids))
+            if user is None:
+                continue
+            if action < 0.8:
+                user.first_name = "First{}".format(rand.randrange(100))
+                user.save()
+            else:
+                user.remove()
+    except Exception as exc:
+        errors.append(exc)
+
+
+def resaver(hot: list, deadline: float, errors: list):
+    """ Save the hot users over and over until deadline
+    """
+    try:
+        while time.monotonic() < deadline:
+            for user in hot:
+                user.save()
+    except Exception as exc:
+        errors.append(exc)
+
+
+def hot_reader(hot: list, deadline: float, errors: list):
+    """ Search the hot users by email until deadline: they must always be
+    found
+    """
+    try:
+        while time.monotonic() < deadline:
+            for user in hot:
+                if user.id not in [found.id for found in
+                                   HotUser.search({'email': user.email})]:
+                    raise AssertionError("search missed an existing user")
+    except Exception as exc:
+        errors.append(exc)
+
+
+def reader(seed: int, ids: list, deadline: float, errors: list):
+    """ Get, search and page through users until deadline
+    """
+    rand = random.Random(seed)
+    try:
+        while time.monotonic() < deadline:
+            if ids:
+                obj_id = rand.choice(ids)
+                user = User.get(obj_id)
+                if user is not None and user.id != obj_id:
+                    raise AssertionError("get returned another object")
+                if user is not None:
+                    for found in User.search({'email': user.email}):
+                        if found.email != user.email:
+                            raise AssertionError("search mismatch")
+            previous = None
+            for user in User.page(limit=50):
+                if previous is not None and user.id <= previous:
+                    raise AssertionError("page out of order")
+                previous = user.id
+            User.count()
+    except Exception as exc:
+        errors.append(exc)
+
+
+def run_threads(threads: list):
+    """ Start threads and wait for them all
+    """
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def run(process: int, seconds: float, threads_count: int) -> tuple:
+    """ Run a resaver against hot readers for the first quarter of the
+    time, switching threads often to widen the odds of a reader landing
+    in the middle of a save, then writer and reader threads, in this
+    process, and return the errors and the JSON of the users its writers
+    own
+    """
+    User.load_from_file()
+    ids = []
+    errors = []
+    HotUser.load_from_file()
+    hot = []
+    for i in range(HOT_USERS):
+        user = HotUser()
+        user.email = "hot{}-{}@example.com".format(process, i)
+        user.save()
+        hot.append(user)
+    deadline = time.monotonic() + seconds / 4
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(HOT_SWITCH_INTERVAL)
+    run_threads([threading.Thread(target=resaver,
+                                  args=(hot, deadline, errors))] +
+                [threading.Thread(target=hot_reader,
+                                  args=(hot, deadline, errors))
+                 for _ in range(threads_count)])
+    sys.setswitchinterval(switch_interval)
+
+    deadline = time.monotonic() + seconds * 3 / 4
+    seeds = [process * threads_count + i for i in range(threads_count)]
+    threads = [threading.Thread(target=writer,
+                                args=(seed, ids, deadline, errors))
+               for seed in seeds]
+    threads += [threading.Thread(target=reader,
+                                 args=(seed, ids, deadline, errors))
+                for seed in seeds]
+    run_threads(threads)
+    flush()
+    owned = {}
+    for obj_id in ids:
+        user = User.get(obj_id)
+        if user is not None:
+            owned[obj_id] = user.to_json(True)
+    return ["{}: {}".format(type(exc).__name__, exc) for exc in errors], \
+        owned
+
+
+if __name__ == "__main__":
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    threads_count = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    processes = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+    os.chdir(tempfile.mkdtemp())
+    if processes == 1:
+        results = [run(0, seconds, threads_count)]
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            results = pool.starmap(run, [(process, seconds, threads_count)
+                                         for process in range(processes)])
+
+    errors = [error for process_errors, _ in results
+              for error in process_errors]
+    in_memory = {}
+    for _, owned in results:
+        in_memory.update(owned)
+    User.load_from_file()
+    on_disk = {user.id: user.to_json(True) for user in User.all()}
+    print("{} processes of {} threads, {} users, {} errors".format(
+        processes, 2 * threads_count, len(in_memory), len(errors)))
+    for error in errors:
+        print(error)
+    if errors or in_memory != on_disk:
+        print("FAILED: reloaded store differs" if in_memory != on_disk
+              else "FAILED")
+        sys.exit(1)
+    print("OK")
@@ -1,19 +1,189 @@
 #!/usr/bin/env python3
 """ Module of Users views
 """
+from datetime import datetime, timezone
 from api.v1.views import app_views
-from flask import abort, jsonify, request
+from flask import Response, abort, jsonify, request, url_for
 from models.user import User
 
+PAGE_LIMIT = 100
+MAX_PAGE_LIMIT = 1000
+STREAM_CHUNK = 100
+MAX_BULK_USERS = 10000
+QUERY_ATTRIBUTES = ('email', 'first_name', 'last_name')
+ORDER_ATTRIBUTES = ('id', 'email', 'first_name', 'last_name', 'created_at',
+                    'updated_at')
+RANGE_PARAMETERS = {'created_after': ('created_at', 0),
+                    'created_before': ('created_at', 1),
+                    'updated_after': ('updated_at', 0),
+                    'updated_before': ('updated_at', 1)}
+
+
+def _flag(name: str) -> bool:
+    """ Value of a boolean query parameter
+    """
+    return request.args.get(name, "").lower() in ("1", "true", "yes")
+
+
+def _query_options() -> dict:
+    """ User.query options of the search query parameters, raising
+    ValueError with the error message when one isn't valid
+    """
+    options = {}
+    attributes = {}
+    prefixes = {}
+    ranges = {}
+    for attr in QUERY_ATTRIBUTES:
+        if attr in request.args:
+            attributes[attr] = request.args[attr]
+        if attr + "_prefix" in request.args:
+            prefixes[attr] = request.args[attr + "_prefix"]
+    for name, (attr, bound) in RANGE_PARAMETERS.items():
+        if name in request.args:
+            try:
+                value = datetime.fromisoformat(request.args[name])
+            except ValueError:
+                raise ValueError("{} must be an ISO 8601 date".format(name))
+            if value.tzinfo is not None:
+                value = value.astimezone(timezone.utc).replace(tzinfo=None)
+            ranges.setdefault(attr, [None, None])[bound] = value
+    if attributes:
+        options['attributes'] = attributes
+    if prefixes:
+        options['prefixes'] = prefixes
+    if ranges:
+        options['ranges'] = {attr: tuple(bounds)
+                             for attr, bounds in ranges.items()}
+    if "order_by" in request.args:
+        order_by = request.args["order_by"]
+        if order_by.lstrip("-") not in ORDER_ATTRIBUTES:
+            raise ValueError("order_by must be one of {}".format(
+                ", ".join(ORDER_ATTRIBUTES)))
+        options['order_by'] = order_by
+    if "offset" in request.args:
+        try:
+            options['offset'] = int(request.args["offset"])
+        except ValueError:
+            options['offset'] = -1
+        if options['offset'] < 0:
+            raise ValueError("offset must be a non-negative integer")
+    return options
+
+
+def _new_user(rj) -> tuple:
+    """ Build an unsaved User from a JSON object, and return it with None
+    as error message, or None with the error message
+    """
+    if type(rj) is not dict:
+        return None, "Wrong format"
+    if rj.get("email", "") == "":
+        return None, "email missing"
+    if rj.get("password", "") == "":
+        return None, "password missing"
+    try:
+        user = User()
+        user.email = rj.get("email")
+        user.password = rj.get("password")
+        user.first_name = rj.get("first_name")
+        user.last_name = rj.get("last_name")
+    except Exception as e:
+        return None, "Can't create User: {}".format(e)
+    return user, None
+
+
+def _users_response(users) -> Response:
+    """ Response of a JSON array of users, spliced from their cached JSON
+    fragments
+    """
+    return Response("[" + ",".join(user.to_json_fragment()
+                                   for user in users) + "]",
+                    mimetype="application/json")
+
+
+def _stream_users(users) -> Response:
+    """ Response streaming a JSON array of users, serialized incrementally
+    """
+    def generate():
+        yield "["
+        chunk = []
+        separator = ""
+        for user in users:
+            chunk.append(separator + user.to_json_fragment())
+            separator = ","
+            if len(chunk) == STREAM_CHUNK:
+                yield "".join(chunk)
+                chunk = []
+        yield "".join(chunk) + "]"
+    return Response(generate(), mimetype="application/json")
+
 
 @app_views.route('/users', methods=['GET'], strict_slashes=False)
 def view_all_users() -> str:
     """ GET /api/v1/users
+    Query parameters:
+      - limit (optional): page size, 100 by default and 1000 at most
+      - after (optional): ID of the last User of the previous page
+      - stream (optional): "true" to stream the JSON array
+      - all (optional): "true" to get every User in one response
+    Search query parameters, paginated by offset instead of after:
+      - email, first_name, last_name (optional): exact value
+      - email_prefix, first_name_prefix, last_name_prefix (optional):
+        start of the value
+      - created_after, created_before, updated_after, updated_before
+        (optional): ISO 8601 bounds, included
+      - order_by (optional): attribute to sort on, "-" first for
+        descending order
+      - offset (optional): number of matching Users to skip
     Return:
-      - list of all User objects JSON represented
+      - list of User objects JSON represented, ordered by ID (or
+        order_by), with a Link header to the next page when there is one
+      - 400 if a query parameter isn't valid
     """
-    all_users = [user.to_json() for user in User.all()]
-    return jsonify(all_users)
+    try:
+        options = _query_options()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if _flag("all"):
+        if _flag("stream"):
+            return _stream_users(User.query(**options) if options
+                                 else User.page())
+        users = User.search(**options) if options else User.all()
+        return _users_response(users)
+
+    try:
+        limit = int(request.args.get("limit", PAGE_LIMIT))
+    except ValueError:
+        limit = 0
+    if limit < 1 or limit > MAX_PAGE_LIMIT:
+        return jsonify({'error': "limit must be between 1 and {}".format(
+            MAX_PAGE_LIMIT)}), 400
+
+    if options and "after" in request.args:
+        return jsonify({'error': "after can't be combined with search "
+                                 "parameters, use offset"}), 400
+
+    if options:
+        users = User.search(limit=limit + 1, **options)
+    else:
+        users = list(User.page(request.args.get("after"), limit + 1))
+    has_next = len(users) > limit
+    users = users[:limit]
+    if _flag("stream"):
+        response = _stream_users(users)
+    else:
+        response = _users_response(users)
+    if has_next:
+        if options:
+            next_url = url_for("app_views.view_all_users", **dict(
+                request.args.items(), limit=limit,
+                offset=options.get('offset', 0) + limit))
+        else:
+            next_url = url_for("app_views.view_all_users", limit=limit,
+                               after=users[-1].id, stream=request.args.get(
+                                   "stream"))
+        response.headers["Link"] = '<{}>; rel="next"'.format(next_url)
+    return response
 
 
 @app_views.route('/users/<user_id>', methods=['GET'], strict_slashes=False)
@@ -71,24 +241,13 @@ def create_user() -> str:
       - 400 if can't create the new User
     """
     rj = None
-    error_msg = None
     try:
         rj = request.get_json()
     except Exception as e:
         rj = None
-    if rj is None:
-        error_msg = "Wrong format"
-    if error_msg is None and rj.get("email", "") == "":
-        error_msg = "email missing"
-    if error_msg is None and rj.get("password", "") == "":
-        error_msg = "password missing"
+    user, error_msg = _new_user(rj)
     if error_msg is None:
         try:
-            user = User()
-            user.email = rj.get("email")
-            user.password = rj.get("password")
-            user.first_name = rj.get("first_name")
-            user.last_name = rj.get("last_name")
             user.save()
             return jsonify(user.to_json()), 201
         except Exception as e:
@@ -96,6 +255,52 @@ def create_user() -> str:
     return jsonify({'error': error_msg}), 400
 
 
+@app_views.route('/users/bulk', methods=['POST'], strict_slashes=False)
+def create_users() -> str:
+    """ POST /api/v1/users/bulk
+    JSON body:
+      - list of at most 10000 objects with the fields of POST
+        /api/v1/users/, which must be strings
+    Return:
+      - list of results in the order of the body: the User object JSON
+        represented under "user" with status 201, or the reason under
+        "error" with status 400; the valid Users are saved together
+      - 400 if the body isn't such a list
+    """
+    rj = None
+    try:
+        rj = request.get_json()
+    except Exception as e:
+        rj = None
+    if type(rj) is not list:
+        return jsonify({'error': "Wrong format"}), 400
+    if len(rj) > MAX_BULK_USERS:
+        return jsonify({'error': "at most {} users".format(
+            MAX_BULK_USERS)}), 400
+
+    results = []
+    users = []
+    for item in rj:
+        user, error_msg = _new_user(item)
+        for attr in ("email", "password", "first_name", "last_name"):
+            if error_msg is None and item.get(attr) is not None and \
+                    type(item.get(attr)) is not str:
+                error_msg = "{} must be a string".format(attr)
+        if error_msg is None:
+            users.append(user)
+            results.append({'status': 201, 'user': user})
+        else:
+            results.append({'status': 400, 'error': error_msg})
+    try:
+        User.save_many(users)
+    except Exception as e:
+        return jsonify({'error': "Can't create Users: {}".format(e)}), 400
+    for result in results:
+        if 'user' in result:
+            result['user'] = result['user'].to_json()
+    return jsonify(results), 200
+
+
 @app_views.route('/users/<user_id>', methods=['PUT'], strict_slashes=False)
 def update_user(user_id: str = None) -> str:
     """ PUT /api/v1/users/:id
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+""" Memory benchmark of the slotted User against the former __dict__ layout
+"""
+import sys
+import tracemalloc
+import uuid
+from datetime import datetime
+from models.user import User
+
+
+class DictUser():
+    """ User laid out as before __slots__: every attribute in __dict__
+    """
+
+    def __init__(self, **kwargs):
+        """ Initialize like User, from serialized attributes
+        """
+        self.id = kwargs.get('id')
+        self.created_at = datetime.fromisoformat(kwargs.get('created_at'))
+        self.updated_at = datetime.fromisoformat(kwargs.get('updated_at'))
+        self.email = kwargs.get('email')
+        self._password = kwargs.get('_password')
+        self.first_name = kwargs.get('first_name')
+        self.last_name = kwargs.get('last_name')
+
+
+def make_records(count: int) -> list:
+    """ Serialized users, as found in .db_User.json
+    """
+    return [{'id': str(uuid.uuid4()),
+             'created_at': '2024-01-01T00:00:00',
+             'updated_at': '2024-01-02T00:00:00',
+             'email': 'user{}@example.com'.format(i),
+             '_password': '{:064x}'.format(i),
+             'first_name': 'First{}'.format(i),
+             'last_name': 'Last{}'.format(i)} for i in range(count)]
+
+
+def measure(cls, records: list, touch_dict: bool = False) -> float:
+    """ Bytes allocated per object to hold the records as cls instances
+    """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objs = [cls(**record) for record in records]
+    if touch_dict:
+        for obj in objs:
+            obj.__dict__
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return used / len(objs)
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    records = make_records(count)
+    slotted = measure(User, records)
+    layouts = (("__dict__ (inline values)", measure(DictUser, records)),
+               ("__dict__ (materialized)", measure(DictUser, records, True)),
+               ("__slots__", slotted))
+    print("{} users".format(count))
+    for name, size in layouts:
+        print("{:<26} {:>8.1f} bytes/user {:>8.1f} MiB".format(
+            name, size, size * count / 2 ** 20))
@@ -1,21 +1,421 @@
 #!/usr/bin/env python3
 """ Base module
 """
+from bisect import bisect_left, bisect_right, insort
+from contextlib import ExitStack, contextmanager
 from datetime import datetime
-from typing import TypeVar, List, Iterable
-from os import path
+from itertools import islice
+from typing import TypeVar, List, Iterable, Iterator
+from os import getenv, path
+import atexit
+import fcntl
 import json
+import logging
+import os
+import threading
+import time
 import uuid
+from models.sqlite_storage import SQLiteStorage
 
 
 TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
+TIMESTAMP_ATTRIBUTES = ('created_at', 'updated_at')
+MAX_ID = chr(0x10ffff)
 DATA = {}
+INDEXES = {}
+SORTED_INDEXES = {}
+JOURNAL_SIZES = {}
+LOAD_STATS = {}
+SLOT_NAMES = {}
+FILE_STATES = {}
+
+STORAGE = getenv("BASE_STORAGE", "file")
+storage = None
+if STORAGE == "sqlite":
+    storage = SQLiteStorage(getenv("BASE_SQLITE_PATH", ".db.sqlite3"),
+                            TIMESTAMP_FORMAT)
+
+STORAGE_MODE = getenv("BASE_STORAGE_MODE", "snapshot")
+JOURNAL_COMPACT_THRESHOLD = int(getenv("BASE_JOURNAL_COMPACT_THRESHOLD",
+                                       1000))
+LOAD_MODE = getenv("BASE_LOAD_MODE", "eager")
+
+DURABILITY = getenv("BASE_DURABILITY", "sync")
+FLUSH_INTERVAL = float(getenv("BASE_FLUSH_INTERVAL", 1.0))
+FLUSH_DIRTY_COUNT = int(getenv("BASE_FLUSH_DIRTY_COUNT", 100))
+PENDING = {}
+_pending_lock = threading.Condition()
+_write_lock = threading.RLock()
+_io_lock = threading.RLock()
+_flusher = None
+
+COHERENCE = getenv("BASE_COHERENCE", "on")
+_file_locks = set()
+
+
+def _pending_count() -> int:
+    """ Number of records waiting to be written
+    """
+    return sum(len(records) for _, records in PENDING.values())
+
+
+def _requeue(pending: List[tuple]):
+    """ Put back (class, records) pairs that could not be written, in
+    front of the records queued since
+    """
+    with _pending_lock:
+        for cls, records in pending:
+            _, queued = PENDING.get(cls.__name__, (cls, []))
+            PENDING[cls.__name__] = (cls, records + queued)
+
+
+def flush():
+    """ Write the pending records of every class; the records of a class
+    whose write fails are queued again before raising
+
+    The records of a class and the objects to write are taken under
+    _write_lock, but the files are written with only their lock held, so
+    that saves deferring their records never wait for the disk.
+    """
+    with _pending_lock:
+        names = list(PENDING)
+    for name in names:
+        with ExitStack() as files:
+            with _write_lock:
+                with _pending_lock:
+                    if name not in PENDING:
+                        continue
+                    cls, records = PENDING.pop(name)
+                try:
+                    files.enter_context(cls._locked())
+                    store = cls._capture(records)
+                except Exception:
+                    _requeue([(cls, records)])
+                    raise
+            try:
+                cls._write_files(records, store)
+            except Exception:
+                _requeue([(cls, records)])
+                raise
+
+
+def _flush_periodically():
+    """ Background loop of write-behind mode: flush every FLUSH_INTERVAL
+    seconds, or as soon as FLUSH_DIRTY_COUNT records are pending
+
+    A failed flush is logged and retried after FLUSH_INTERVAL seconds.
+    """
+    while True:
+        with _pending_lock:
+            _pending_lock.wait_for(
+                lambda: _pending_count() >= FLUSH_DIRTY_COUNT,
+                FLUSH_INTERVAL)
+        try:
+            flush()
+        except Exception:
+            logging.getLogger(__name__).exception(
+                "flush failed, retrying in %s seconds", FLUSH_INTERVAL)
+            time.sleep(FLUSH_INTERVAL)
+
+
+def _defer(cls, records: List[dict]):
+    """ Queue records for the background flusher, starting it if needed
+    """
+    global _flusher
+    with _pending_lock:
+        PENDING.setdefault(cls.__name__, (cls, []))[1].extend(records)
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_periodically,
+                                        name="base-flusher", daemon=True)
+            _flusher.start()
+            atexit.register(flush)
+        if _pending_count() >= FLUSH_DIRTY_COUNT:
+            _pending_lock.notify()
+
+
+def _file_state(file_path: str) -> tuple:
+    """ Identity of a file as (inode, modification time, size), or None
+    if it does not exist
+    """
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+def _parse_timestamp(value: str) -> datetime:
+    """ Parse a TIMESTAMP_FORMAT string, through the much faster
+    fromisoformat when it has the expected fixed layout
+    """
+    if len(value) == 19 and value[10] == 'T':
+        return datetime.fromisoformat(value)
+    return datetime.strptime(value, TIMESTAMP_FORMAT)
+
+
+def _attribute(obj, attribute: str):
+    """ Value of an attribute of a stored object, which may still be a raw
+    JSON dictionary whose timestamps are strings
+    """
+    if type(obj) is dict:
+        value = obj.get(attribute)
+        if value is not None and attribute in TIMESTAMP_ATTRIBUTES:
+            return _parse_timestamp(value)
+        return value
+    return getattr(obj, attribute, None)
+
+
+def _kind(value) -> str:
+    """ Name of the group of values a value can be ordered with: numbers
+    together, anything else with the values of its own type
+    """
+    if isinstance(value, (int, float)):
+        return "number"
+    return type(value).__name__
+
+
+class LazyObjects(dict):
+    """ Objects of a class by ID, kept as their raw JSON dictionaries and
+    only instantiated when first accessed
+
+    Instantiating only replaces the value of an existing key, which is
+    safe while other threads read or iterate the dictionary.
+    """
+
+    def __init__(self, cls, objs_json: dict):
+        """ Initialize from the loaded JSON dictionaries, by ID
+        """
+        super().__init__(objs_json)
+        self.cls = cls
+
+    def _hydrate(self, obj_id: str, obj):
+        """ Instantiate a stored object if still raw
+        """
+        if type(obj) is dict:
+            obj = self.cls(**obj)
+            dict.__setitem__(self, obj_id, obj)
+        return obj
+
+    def __getitem__(self, obj_id: str):
+        """ Return the object of an ID
+        """
+        return self._hydrate(obj_id, dict.__getitem__(self, obj_id))
+
+    def get(self, obj_id: str, default=None):
+        """ Return the object of an ID, or default
+        """
+        obj = dict.get(self, obj_id)
+        if obj is None:
+            return default
+        return self._hydrate(obj_id, obj)
+
+    def values(self):
+        """ Return all the objects, instantiating the raw ones
+        """
+        for obj_id, obj in dict.items(self):
+            if type(obj) is dict:
+                self._hydrate(obj_id, obj)
+        return dict.values(self)
+
+    def items(self):
+        """ Return all the (ID, object) pairs
+        """
+        self.values()
+        return dict.items(self)
+
+    def copy(self):
+        """ Return a shallow copy, keeping the raw objects raw
+        """
+        return LazyObjects(self.cls, self)
+
+
+class Index():
+    """ Hash index of the object IDs of a class on one attribute
+
+    Buckets are tuples replaced on every change, so a bucket handed to a
+    reader never changes under it.
+    """
+
+    def __init__(self, attribute: str):
+        """ Initialize an empty index
+        """
+        self.attribute = attribute
+        self.entries = {}
+        self.values = {}
+
+    def add_many(self, pairs: Iterable[tuple]):
+        """ Index many (ID, value) pairs at once
+
+        The IDs are put under their new value before leaving the old one,
+        so a reader never misses an indexed object.
+        """
+        added = {}
+        moved = []
+        for obj_id, value in dict(pairs).items():
+            if obj_id in self.values:
+                if self.values[obj_id] == value:
+                    continue
+                moved.append((obj_id, self.values[obj_id]))
+            added.setdefault(value, []).append(obj_id)
+            self.values[obj_id] = value
+        for value, obj_ids in added.items():
+            self.entries[value] = self.entries.get(value, ()) + \
+                tuple(obj_ids)
+        for obj_id, value in moved:
+            self._leave(obj_id, value)
+
+    def add(self, obj_id: str, value):
+        """ Index an object ID under a value of the attribute, putting it
+        under the new value before leaving the old one
+        """
+        moved = obj_id in self.values
+        old_value = self.values.get(obj_id)
+        if moved and old_value == value:
+            return
+        self.entries[value] = self.entries.get(value, ()) + (obj_id,)
+        self.values[obj_id] = value
+        if moved:
+            self._leave(obj_id, old_value)
+
+    def _leave(self, obj_id: str, value):
+        """ Remove an object ID from the bucket of a value
+        """
+        bucket = tuple(i for i in self.entries[value] if i != obj_id)
+        if len(bucket) == 0:
+            del self.entries[value]
+        else:
+            self.entries[value] = bucket
+
+    def discard(self, obj_id: str):
+        """ Remove an object from the index
+        """
+        if obj_id not in self.values:
+            return
+        self._leave(obj_id, self.values.pop(obj_id))
+
+    def lookup(self, value) -> tuple:
+        """ Return the IDs indexed under a value
+        """
+        return self.entries.get(value, ())
+
+
+class SortedIndex():
+    """ Sorted index of the object IDs of a class on one attribute, for
+    ordered scans
+
+    The key list is copied on write and swapped, so readers can bisect
+    and slice the list they got without locking. Values of different kinds
+    (see _kind) are never compared: they sort by kind first.
+    """
+
+    def __init__(self, attribute: str):
+        """ Initialize an empty index
+        """
+        self.attribute = attribute
+        self.keys = []
+        self.values = {}
+
+    @staticmethod
+    def key(value, obj_id: str) -> tuple:
+        """ Sort key of an object: None values first, then values grouped
+        by kind, ties broken by ID
+        """
+        return (value is not None, _kind(value), value, obj_id)
+
+    def range(self, low=None, high=None) -> list:
+        """ Keys of the values between low and high included, None leaving
+        a bound open; with a single bound, only values of its kind
+        """
+        keys = self.keys
+        if low is not None:
+            start = bisect_left(keys, (True, _kind(low), low))
+        else:
+            start = bisect_left(keys, (True,) if high is None
+                                else (True, _kind(high)))
+        if high is not None:
+            end = bisect_right(keys, (True, _kind(high), high, MAX_ID))
+        elif low is not None:
+            end = bisect_left(keys, (True, _kind(low) + "\0"))
+        else:
+            end = len(keys)
+        return keys[start:end]
+
+    def prefix(self, prefix: str) -> list:
+        """ Keys of the string values starting with prefix
+        """
+        keys = self.keys
+        if prefix == "" or prefix[-1] == MAX_ID:
+            return self.range(prefix)
+        end = bisect_left(keys, (True, "str",
+                                 prefix[:-1] + chr(ord(prefix[-1]) + 1)))
+        return keys[bisect_left(keys, (True, "str", prefix)):end]
+
+    def add_many(self, pairs: Iterable[tuple]):
+        """ Index many (ID, value) pairs at once, sorting the keys once
+        """
+        stale = set()
+        added = []
+        for obj_id, value in dict(pairs).items():
+            if obj_id in self.values:
+                stale.add(self.key(self.values[obj_id], obj_id))
+            self.values[obj_id] = value
+            added.append(self.key(value, obj_id))
+        keys = [key for key in self.keys if key not in stale] if stale \
+            else self.keys[:]
+        keys.extend(added)
+        keys.sort()
+        self.keys = keys
+
+    def add(self, obj_id: str, value):
+        """ Index an object ID under a value of the attribute
+        """
+        keys = self.keys[:]
+        if obj_id in self.values:
+            old_key = self.key(self.values[obj_id], obj_id)
+            del keys[bisect_left(keys, old_key)]
+        insort(keys, self.key(value, obj_id))
+        self.values[obj_id] = value
+        self.keys = keys
+
+    def discard(self, obj_id: str):
+        """ Remove an object from the index
+        """
+        if obj_id not in self.values:
+            return
+        keys = self.keys[:]
+        del keys[bisect_left(keys, self.key(self.values[obj_id], obj_id))]
+        del self.values[obj_id]
+        self.keys = keys
 
 
 class Base():
     """ Base class
+
+    Models declare their attributes in __slots__ so instances carry no
+    per-object __dict__; a subclass without __slots__ still gets one.
+
+    The JSON representations of an object are cached in its _json_cache
+    slot, which setting any attribute clears; mutating a list or dict
+    attribute in place does not, so assign a new value instead.
+
+    DATA[<class name>] is a snapshot never modified once published:
+    writers, serialized by a lock, build a modified copy and swap it in,
+    so readers never take a lock nor see a dictionary change under them.
+
+    With BASE_STORAGE=sqlite, objects are not kept in DATA: every method
+    below goes to the SQLite storage instead of the JSON files.
+
+    Processes sharing the files (BASE_COHERENCE=on, the default) write
+    them under an advisory lock, after catching up with the changes of
+    the others; readers compare the files' identity with the one last
+    seen and reload, only the new journal records when possible, if
+    another process changed them.
     """
 
+    __slots__ = ('id', 'created_at', 'updated_at', '_json_cache')
+    indexed_attributes = ()
+    sorted_attributes = ('id',)
+
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a Base instance
         """
@@ -23,18 +423,22 @@ class Base():
         if DATA.get(s_class) is None:
             DATA[s_class] = {}
 
-        self.id = kwargs.get('id', str(uuid.uuid4()))
+        self.id = kwargs['id'] if 'id' in kwargs else str(uuid.uuid4())
         if kwargs.get('created_at') is not None:
-            self.created_at = datetime.strptime(kwargs.get('created_at'),
-                                                TIMESTAMP_FORMAT)
+            self.created_at = _parse_timestamp(kwargs.get('created_at'))
         else:
             self.created_at = datetime.utcnow()
         if kwargs.get('updated_at') is not None:
-            self.updated_at = datetime.strptime(kwargs.get('updated_at'),
-                                                TIMESTAMP_FORMAT)
+            self.updated_at = _parse_timestamp(kwargs.get('updated_at'))
         else:
             self.updated_at = datetime.utcnow()
 
+    def __setattr__(self, name: str, value):
+        """ Set an attribute, dropping the cached JSON representations
+        """
+        object.__setattr__(self, name, value)
+        object.__setattr__(self, '_json_cache', None)
+
     def __eq__(self, other: TypeVar('Base')) -> bool:
         """ Equality
         """
@@ -44,67 +448,456 @@ class Base():
             return False
         return (self.id == other.id)
 
+    @classmethod
+    def _slot_names(cls) -> tuple:
+        """ Names of the slots of the class and its parents, in definition
+        order
+        """
+        names = SLOT_NAMES.get(cls)
+        if names is None:
+            names = tuple(name for klass in reversed(cls.__mro__)
+                          for name in klass.__dict__.get('__slots__', ())
+                          if name not in ('__dict__', '__weakref__',
+                                          '_json_cache'))
+            SLOT_NAMES[cls] = names
+        return names
+
+    def _attributes(self) -> Iterable[tuple]:
+        """ (name, value) pairs of the attributes set on the object
+        """
+        for key in self._slot_names():
+            try:
+                yield key, getattr(self, key)
+            except AttributeError:
+                continue
+        yield from getattr(self, '__dict__', {}).items()
+
+    def _cache(self) -> dict:
+        """ Cache of the JSON representations of the object, created empty
+        if needed
+        """
+        cache = getattr(self, '_json_cache', None)
+        if cache is None:
+            cache = {}
+            object.__setattr__(self, '_json_cache', cache)
+        return cache
+
     def to_json(self, for_serialization: bool = False) -> dict:
         """ Convert the object a JSON dictionary
         """
-        result = {}
-        for key, value in self.__dict__.items():
-            if not for_serialization and key[0] == '_':
-                continue
-            if type(value) is datetime:
-                result[key] = value.strftime(TIMESTAMP_FORMAT)
+        for_serialization = bool(for_serialization)
+        cache = self._cache()
+        result = cache.get(for_serialization)
+        if result is None:
+            result = {}
+            for key, value in self._attributes():
+                if not for_serialization and key[0] == '_':
+                    continue
+                if type(value) is datetime:
+                    result[key] = value.strftime(TIMESTAMP_FORMAT)
+                else:
+                    result[key] = value
+            cache[for_serialization] = result
+        return dict(result)
+
+    def to_json_fragment(self) -> str:
+        """ Encoded JSON of to_json(), to splice into a JSON array
+        """
+        cache = self._cache()
+        fragment = cache.get('fragment')
+        if fragment is None:
+            fragment = json.dumps(self.to_json())
+            cache['fragment'] = fragment
+        return fragment
+
+    @classmethod
+    def load_from_file(cls) -> dict:
+        """ Load all objects from file, replaying the journal on top of
+        the snapshot, and return the load statistics
+
+        In lazy mode objects stay raw JSON dictionaries until first
+        accessed through get or search.
+        """
+        if storage is not None:
+            start = time.perf_counter()
+            LOAD_STATS[cls.__name__] = {
+                "mode": STORAGE, "objects": storage.load(cls),
+                "seconds": time.perf_counter() - start}
+            return LOAD_STATS[cls.__name__]
+        with _write_lock, cls._locked():
+            flush()
+            start = time.perf_counter()
+            s_class = cls.__name__
+            file_path = ".db_{}.json".format(s_class)
+            objs_json = {}
+            if path.exists(file_path):
+                with open(file_path, 'r') as f:
+                    objs_json = json.load(f)
+            if LOAD_MODE == "lazy":
+                store = LazyObjects(cls, objs_json)
+            else:
+                store = {obj_id: cls(**obj_json)
+                         for obj_id, obj_json in objs_json.items()}
+            torn = cls._replay_journal(store)
+            FILE_STATES[s_class] = cls._files_state()
+            DATA[s_class] = store
+            cls._build_indexes()
+            LOAD_STATS[s_class] = {"mode": LOAD_MODE,
+                                   "objects": len(store),
+                                   "seconds": time.perf_counter() - start}
+            if torn:
+                cls.save_to_file()
+            return LOAD_STATS[s_class]
+
+    @classmethod
+    def _replay_journal(cls, store: dict) -> bool:
+        """ Apply the journal records to the loaded objects, not published
+        yet, and tell if it ends with a torn record left by an interrupted
+        write
+        """
+        records, torn = cls._read_journal()
+        cls._replay(store, records)
+        JOURNAL_SIZES[cls.__name__] = len(records)
+        return torn
+
+    @classmethod
+    def _read_journal(cls, offset: int = 0) -> tuple:
+        """ Read the journal records from a byte offset, and tell if it
+        ends with a torn record left by an interrupted write
+        """
+        records = []
+        try:
+            f = open(".db_{}.journal".format(cls.__name__), 'rb')
+        except FileNotFoundError:
+            return records, False
+        with f:
+            f.seek(offset)
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    return records, True
+        return records, False
+
+    @classmethod
+    def _replay(cls, store: dict, records: List[dict], live: dict = None):
+        """ Apply save and remove records to a store of objects; a saved
+        object found in live is reused instead of being rebuilt from its
+        JSON
+        """
+        lazy = isinstance(store, LazyObjects)
+        for record in records:
+            if record["op"] == "save":
+                obj_json = record["obj"]
+                obj = None if live is None else live.get(obj_json["id"])
+                if obj is None:
+                    obj = obj_json if lazy else cls(**obj_json)
+                store[obj_json["id"]] = obj
             else:
-                result[key] = value
-        return result
+                store.pop(record["id"], None)
 
     @classmethod
-    def load_from_file(cls):
-        """ Load all objects from file
+    def _apply(cls, records: List[dict], live: dict = None):
+        """ Apply save and remove records to the published objects and
+        their indexes
         """
         s_class = cls.__name__
-        file_path = ".db_{}.json".format(s_class)
-        DATA[s_class] = {}
-        if not path.exists(file_path):
+        store = DATA[s_class].copy()
+        cls._replay(store, records, live)
+        DATA[s_class] = store
+        cls._reindex(store, {record["obj"]["id"] if record["op"] == "save"
+                             else record["id"] for record in records})
+
+    @classmethod
+    def _reindex(cls, store: dict, obj_ids: Iterable[str]):
+        """ Bring the indexes up to date with the objects of some IDs in a
+        store, those missing from it being dropped
+        """
+        objs = [(obj_id, dict.get(store, obj_id)) for obj_id in obj_ids]
+        saved = [(obj_id, obj) for obj_id, obj in objs if obj is not None]
+        for attr, index in cls._all_indexes():
+            if len(saved) == 1:
+                index.add(saved[0][0], _attribute(saved[0][1], attr))
+            elif len(saved) > 1:
+                index.add_many((obj_id, _attribute(obj, attr))
+                               for obj_id, obj in saved)
+            for obj_id, obj in objs:
+                if obj is None:
+                    index.discard(obj_id)
+
+    @classmethod
+    def _commit(cls, store: dict, obj_ids: List[str], records: List[dict],
+                durable: bool = None):
+        """ Publish a modified copy of the objects, index the changed IDs
+        and persist their records
+
+        If any of it fails, the previous objects and indexes are restored
+        before raising, and in case the files were changed already, the
+        next read reloads them.
+        """
+        s_class = cls.__name__
+        previous = DATA[s_class]
+        DATA[s_class] = store
+        try:
+            cls._reindex(store, obj_ids)
+            cls._persist(records, durable)
+        except Exception:
+            DATA[s_class] = previous
+            cls._build_indexes()
+            FILE_STATES.pop(s_class, None)
+            raise
+
+    @classmethod
+    @contextmanager
+    def _locked(cls):
+        """ Hold the advisory lock serializing the accesses of processes
+        to the files of the class, and _io_lock, which serializes the
+        threads of this process; re-entrant. When _write_lock is needed as
+        well, it must be taken first
+        """
+        s_class = cls.__name__
+        with _io_lock:
+            if s_class in _file_locks:
+                yield
+                return
+            with open(".db_{}.lock".format(s_class), 'a') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                _file_locks.add(s_class)
+                try:
+                    yield
+                finally:
+                    _file_locks.discard(s_class)
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    @classmethod
+    def _files_state(cls) -> tuple:
+        """ Identity of the snapshot and journal files of the class
+        """
+        s_class = cls.__name__
+        return (_file_state(".db_{}.json".format(s_class)),
+                _file_state(".db_{}.journal".format(s_class)))
+
+    @classmethod
+    def _stale(cls) -> bool:
+        """ Tell if the files of the class changed since this process last
+        read or wrote them
+        """
+        return FILE_STATES.get(cls.__name__) != cls._files_state()
+
+    @classmethod
+    def _sync(cls):
+        """ Catch up with the changes other processes made to the files of
+        the class, if any
+        """
+        if COHERENCE != "on" or not cls._stale():
             return
+        with _write_lock, cls._locked():
+            cls._catch_up()
 
-        with open(file_path, 'r') as f:
-            objs_json = json.load(f)
-            for obj_id, obj_json in objs_json.items():
-                DATA[s_class][obj_id] = cls(**obj_json)
+    @classmethod
+    def _catch_up(cls):
+        """ Reload the files of the class if they changed: only the records
+        appended to the journal when the snapshot is the same, everything
+        otherwise
+        """
+        flush()
+        s_class = cls.__name__
+        known = FILE_STATES.get(s_class)
+        current = cls._files_state()
+        if known == current:
+            return
+        journal = current[1]
+        if known is not None and s_class in DATA and \
+                known[0] == current[0] and journal is not None and \
+                (known[1] is None or (known[1][0] == journal[0] and
+                                      known[1][2] <= journal[2])):
+            offset = 0 if known[1] is None else known[1][2]
+            records, torn = cls._read_journal(offset)
+            if not torn:
+                cls._apply(records)
+                JOURNAL_SIZES[s_class] = \
+                    JOURNAL_SIZES.get(s_class, 0) + len(records)
+                FILE_STATES[s_class] = current
+                return
+        cls.load_from_file()
+
+    @classmethod
+    def _merge(cls, records: List[dict]):
+        """ Before writing records already applied in memory, catch up with
+        the other processes then apply the records again so they win
+        """
+        if COHERENCE != "on" or not cls._stale():
+            return
+        live = DATA[cls.__name__]
+        cls._catch_up()
+        cls._apply(records, live)
 
     @classmethod
     def save_to_file(cls):
         """ Save all objects to file
+
+        The snapshot is written to a temporary file then renamed over the
+        previous one, after which the journal it covers is dropped.
+        """
+        if storage is not None:
+            return
+        with _write_lock, cls._locked():
+            cls._dump(DATA[cls.__name__])
+
+    @classmethod
+    def _dump(cls, store: dict):
+        """ Write a snapshot of the objects of a store, holding the file
+        lock
         """
         s_class = cls.__name__
         file_path = ".db_{}.json".format(s_class)
         objs_json = {}
-        for obj_id, obj in DATA[s_class].items():
-            objs_json[obj_id] = obj.to_json(True)
+        for obj_id, obj in dict.items(store):
+            if type(obj) is dict:
+                objs_json[obj_id] = obj
+            else:
+                objs_json[obj_id] = obj.to_json(True)
 
-        with open(file_path, 'w') as f:
+        tmp_path = "{}.tmp".format(file_path)
+        with open(tmp_path, 'w') as f:
             json.dump(objs_json, f)
+        os.replace(tmp_path, file_path)
+
+        journal_path = ".db_{}.journal".format(s_class)
+        if path.exists(journal_path):
+            os.remove(journal_path)
+        JOURNAL_SIZES[s_class] = 0
+        FILE_STATES[s_class] = cls._files_state()
+
+    @classmethod
+    def append_to_journal(cls, records: List[dict]):
+        """ Append records to the journal file in one write, compacting the
+        journal into a new snapshot once it passes JOURNAL_COMPACT_THRESHOLD
+        """
+        with _write_lock, cls._locked():
+            cls._append(records, DATA[cls.__name__])
+
+    @classmethod
+    def _append(cls, records: List[dict], store: dict):
+        """ Append records to the journal, holding the file lock, and
+        compact it into a snapshot of the objects of store if needed
+        """
+        s_class = cls.__name__
+        journal_path = ".db_{}.journal".format(s_class)
+        with open(journal_path, 'a') as f:
+            f.write("".join(json.dumps(record) + "\n"
+                            for record in records))
+        JOURNAL_SIZES[s_class] = JOURNAL_SIZES.get(s_class, 0) + len(records)
+        FILE_STATES[s_class] = cls._files_state()
+        if JOURNAL_SIZES[s_class] >= JOURNAL_COMPACT_THRESHOLD:
+            cls._dump(store)
+
+    @classmethod
+    def _write(cls, records: List[dict]):
+        """ Write save or remove records: appended to the journal in
+        journal mode, or by rewriting the whole snapshot otherwise
+        """
+        with _write_lock, cls._locked():
+            cls._write_files(records, cls._capture(records))
+
+    @classmethod
+    def _capture(cls, records: List[dict]) -> dict:
+        """ Catch up with the other processes before writing records, and
+        return the objects to write along with them; needs _write_lock
+        and the file lock
+        """
+        cls._merge(records)
+        return DATA[cls.__name__]
+
+    @classmethod
+    def _write_files(cls, records: List[dict], store: dict):
+        """ Append records to the journal in journal mode, or write the
+        snapshot of the objects of store otherwise; only needs the file
+        lock
+        """
+        if STORAGE_MODE == "journal":
+            cls._append(records, store)
+        else:
+            cls._dump(store)
+
+    @classmethod
+    def _persist(cls, records: List[dict], durable: bool = None):
+        """ Persist records now, or leave them to the background flusher
+        in write-behind mode unless durable is True
+        """
+        if durable is None:
+            durable = DURABILITY != "write_behind"
+        if not durable:
+            _defer(cls, records)
+            return
+        with _write_lock, cls._locked():
+            with _pending_lock:
+                _, pending = PENDING.pop(cls.__name__, (cls, []))
+            try:
+                cls._write(pending + records)
+            except Exception:
+                _requeue([(cls, pending)])
+                raise
 
-    def save(self):
+    def save(self, durable: bool = None):
         """ Save current object
         """
+        if storage is not None:
+            self.updated_at = datetime.utcnow()
+            storage.save(self)
+            return
         s_class = self.__class__.__name__
-        self.updated_at = datetime.utcnow()
-        DATA[s_class][self.id] = self
-        self.__class__.save_to_file()
+        with _write_lock:
+            self.updated_at = datetime.utcnow()
+            store = DATA[s_class].copy()
+            store[self.id] = self
+            self.__class__._commit(store, [self.id], [
+                {"op": "save", "obj": self.to_json(True)}], durable)
+
+    @classmethod
+    def save_many(cls, objs: List[TypeVar('Base')], durable: bool = None):
+        """ Save many objects of the class at once: they are added to DATA
+        and the indexes in one pass, and persisted with a single write
+        """
+        if storage is not None:
+            now = datetime.utcnow()
+            for obj in objs:
+                obj.updated_at = now
+            storage.save_many(cls, objs)
+            return
+        s_class = cls.__name__
+        with _write_lock:
+            now = datetime.utcnow()
+            store = DATA[s_class].copy()
+            for obj in objs:
+                obj.updated_at = now
+                store[obj.id] = obj
+            cls._commit(store, [obj.id for obj in objs],
+                        [{"op": "save", "obj": obj.to_json(True)}
+                         for obj in objs], durable)
 
-    def remove(self):
+    def remove(self, durable: bool = None):
         """ Remove object
         """
+        if storage is not None:
+            storage.remove(self)
+            return
         s_class = self.__class__.__name__
-        if DATA[s_class].get(self.id) is not None:
-            del DATA[s_class][self.id]
-            self.__class__.save_to_file()
+        with _write_lock:
+            if DATA[s_class].get(self.id) is None:
+                return
+            store = DATA[s_class].copy()
+            del store[self.id]
+            self.__class__._commit(store, [self.id], [
+                {"op": "remove", "id": self.id}], durable)
 
     @classmethod
     def count(cls) -> int:
         """ Count all objects
         """
+        if storage is not None:
+            return storage.count(cls)
+        cls._sync()
         s_class = cls.__name__
         return len(DATA[s_class].keys())
 
@@ -118,20 +911,164 @@ class Base():
     def get(cls, id: str) -> TypeVar('Base'):
         """ Return one object by ID
         """
+        if storage is not None:
+            return storage.get(cls, id)
+        cls._sync()
         s_class = cls.__name__
         return DATA[s_class].get(id)
 
     @classmethod
-    def search(cls, attributes: dict = {}) -> List[TypeVar('Base')]:
-        """ Search all objects with matching attributes
+    def _build_indexes(cls):
+        """ Rebuild the indexes of the class from its objects
+        """
+        with _write_lock:
+            s_class = cls.__name__
+            store = DATA.get(s_class, {})
+            indexes = {attr: Index(attr) for attr in cls.indexed_attributes}
+            sorted_indexes = {attr: SortedIndex(attr)
+                              for attr in cls.sorted_attributes}
+            for attr, index in list(indexes.items()) + \
+                    list(sorted_indexes.items()):
+                index.add_many((obj_id, _attribute(obj, attr))
+                               for obj_id, obj in dict.items(store))
+            INDEXES[s_class] = indexes
+            SORTED_INDEXES[s_class] = sorted_indexes
+
+    @classmethod
+    def _indexes(cls) -> dict:
+        """ Return the indexes of the class, by attribute
+        """
+        s_class = cls.__name__
+        if INDEXES.get(s_class) is None:
+            cls._build_indexes()
+        return INDEXES[s_class]
+
+    @classmethod
+    def _sorted_indexes(cls) -> dict:
+        """ Return the sorted indexes of the class, by attribute
+        """
+        s_class = cls.__name__
+        if SORTED_INDEXES.get(s_class) is None:
+            cls._build_indexes()
+        return SORTED_INDEXES[s_class]
+
+    @classmethod
+    def _all_indexes(cls) -> Iterator[tuple]:
+        """ (attribute, index) pairs of every index of the class
+        """
+        yield from cls._indexes().items()
+        yield from cls._sorted_indexes().items()
+
+    @classmethod
+    def page(cls, after: str = None,
+             limit: int = None) -> Iterator[TypeVar('Base')]:
+        """ Iterate the objects ordered by ID, starting right after the ID
+        `after` (which needs not exist anymore), at most `limit` of them
+        """
+        if storage is not None:
+            yield from storage.page(cls, after, limit)
+            return
+        cls._sync()
+        s_class = cls.__name__
+        keys = cls._sorted_indexes()['id'].keys
+        store = DATA[s_class]
+        start = 0
+        if after is not None:
+            start = bisect_right(keys, SortedIndex.key(after, after))
+        end = len(keys) if limit is None else start + limit
+        for key in keys[start:end]:
+            obj = store.get(key[-1])
+            if obj is not None:
+                yield obj
+
+    @classmethod
+    def search(cls, attributes: dict = {},
+               **options) -> List[TypeVar('Base')]:
+        """ Search all objects with matching attributes, taking the options
+        of query
         """
+        return list(cls.query(attributes, **options))
+
+    @classmethod
+    def query(cls, attributes: dict = {}, prefixes: dict = {},
+              ranges: dict = {}, order_by: str = None, offset: int = 0,
+              limit: int = None) -> Iterator[TypeVar('Base')]:
+        """ Iterate the objects whose attributes equal the values of
+        attributes, start with the strings of prefixes and lie within the
+        (low, high) bounds of ranges, included, where None leaves a bound
+        open
+
+        order_by names the attribute to sort on, with a leading "-" for
+        descending order, ties being broken by ID; without it the order is
+        unspecified. The first offset matches are skipped, and at most
+        limit of them are returned.
+
+        Only the objects of the smallest matching index bucket or sorted
+        index range are checked (and instantiated, in lazy mode) instead
+        of every object. When that range is on order_by, or there is no
+        such index, objects come straight in the order of the sorted
+        index of order_by and the scan stops once limit are found.
+        """
+        if storage is not None:
+            yield from storage.query(cls, attributes, prefixes, ranges,
+                                     order_by, offset, limit)
+            return
+        cls._sync()
         s_class = cls.__name__
+        descending = order_by is not None and order_by[0] == "-"
+        order_attr = order_by[1:] if descending else order_by
+
         def _search(obj):
-            if len(attributes) == 0:
-                return True
             for k, v in attributes.items():
                 if (getattr(obj, k) != v):
                     return False
+            for k, prefix in prefixes.items():
+                value = getattr(obj, k, None)
+                if type(value) is not str or not value.startswith(prefix):
+                    return False
+            for k, (low, high) in ranges.items():
+                value = getattr(obj, k, None)
+                if value is None or any(
+                        bound is not None and _kind(bound) != _kind(value)
+                        for bound in (low, high)):
+                    return False
+                if (low is not None and value < low) or \
+                        (high is not None and value > high):
+                    return False
             return True
-        
-        return list(filter(_search, DATA[s_class].values()))
+
+        store = DATA[s_class]
+        indexes = cls._indexes()
+        sorted_indexes = cls._sorted_indexes()
+        obj_ids = None
+        sorted_on = None
+        for k, v in attributes.items():
+            if k in indexes:
+                bucket = indexes[k].lookup(v)
+                if obj_ids is None or len(bucket) < len(obj_ids):
+                    obj_ids, sorted_on = bucket, None
+        for k, bound in list(prefixes.items()) + list(ranges.items()):
+            if k in sorted_indexes:
+                keys = sorted_indexes[k].prefix(bound) if k in prefixes \
+                    else sorted_indexes[k].range(*bound)
+                if obj_ids is None or len(keys) < len(obj_ids):
+                    obj_ids, sorted_on = keys, k
+        if obj_ids is None and order_attr in sorted_indexes:
+            obj_ids = sorted_indexes[order_attr].keys
+            sorted_on = order_attr
+
+        if obj_ids is None:
+            objs = store.values()
+        else:
+            if sorted_on is not None:
+                if sorted_on == order_attr and descending:
+                    obj_ids = reversed(obj_ids)
+                obj_ids = (key[-1] for key in obj_ids)
+            objs = filter(None, (store.get(obj_id) for obj_id in obj_ids))
+        objs = filter(_search, objs)
+        if order_attr is not None and sorted_on != order_attr:
+            objs = sorted(objs, reverse=descending, key=lambda obj:
+                          SortedIndex.key(getattr(obj, order_attr, None),
+                                          obj.id))
+        yield from islice(objs, offset,
+                          None if limit is None else offset + limit)
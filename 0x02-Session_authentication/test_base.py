@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+""" Unit tests of models.base
+"""
+from datetime import datetime
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+import models.base as base
+from models.base import DATA, PENDING, Index, flush
+from models.sqlite_storage import SQLiteStorage
+from models.user import User
+
+
+class StoreTestCase(unittest.TestCase):
+    """ Runs each test in its own directory, on an empty store
+    """
+
+    def setUp(self):
+        """ Move to a new directory and load the empty store
+        """
+        self.cwd = os.getcwd()
+        self.dir = tempfile.mkdtemp()
+        os.chdir(self.dir)
+        User.load_from_file()
+
+    def tearDown(self):
+        """ Drop the pending records and the directory
+        """
+        PENDING.clear()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.dir)
+
+    @staticmethod
+    def new_user(email: str) -> User:
+        """ Return a new saved user
+        """
+        user = User()
+        user.email = email
+        user.password = "pwd"
+        user.save()
+        return user
+
+    @staticmethod
+    def reloaded_emails() -> list:
+        """ Emails of the users read back from the files
+        """
+        User.load_from_file()
+        return sorted(user.email for user in User.all())
+
+
+class FailingWrite():
+    """ Replacement of User._write_files raising OSError on its first
+    calls
+    """
+
+    def __init__(self, failures: int = 1):
+        """ Initialize with the number of calls to fail
+        """
+        self.failures = failures
+        self.write = User._write_files
+
+    def __call__(self, records, store):
+        """ Fail, or write the records
+        """
+        if self.failures > 0:
+            self.failures -= 1
+            raise OSError("disk full")
+        self.write(records, store)
+
+
+class BlockedWrite():
+    """ Replacement of User._write_files waiting for a release
+    """
+
+    def __init__(self):
+        """ Initialize blocked
+        """
+        self.write = User._write_files
+        self.writing = threading.Event()
+        self.released = threading.Event()
+
+    def __call__(self, records, store):
+        """ Wait for the release, then write the records
+        """
+        self.writing.set()
+        self.released.wait(5)
+        self.write(records, store)
+
+
+@mock.patch.object(base, "STORAGE_MODE", "journal")
+@mock.patch.object(base, "DURABILITY", "write_behind")
+@mock.patch.object(base, "_flusher", object())
+class TestWriteBehind(StoreTestCase):
+    """ Records deferred to the background flusher, which is replaced by
+    explicit calls to flush
+    """
+
+    def test_failed_flush_keeps_records(self):
+        """ Records whose write failed are written by the next flush,
+        before the records saved since
+        """
+        with mock.patch.object(User, "_write_files", FailingWrite()):
+            self.new_user("a@x.com")
+            with self.assertRaises(OSError):
+                flush()
+            self.new_user("b@x.com")
+            self.assertEqual([record["obj"]["email"]
+                              for record in PENDING["User"][1]],
+                             ["a@x.com", "b@x.com"])
+            flush()
+        self.assertEqual(PENDING, {})
+        self.assertEqual(self.reloaded_emails(), ["a@x.com", "b@x.com"])
+
+    def test_flusher_survives_failure(self):
+        """ The flusher logs a failed flush and keeps running
+        """
+        self.new_user("a@x.com")
+        sleep = mock.Mock(side_effect=[None, KeyboardInterrupt])
+        with mock.patch.object(User, "_write_files", FailingWrite(2)), \
+                mock.patch.object(base.time, "sleep", sleep), \
+                mock.patch.object(base, "FLUSH_INTERVAL", 0), \
+                self.assertLogs(base.__name__) as logs:
+            with self.assertRaises(KeyboardInterrupt):
+                base._flush_periodically()
+        self.assertEqual(len(logs.records), 2)
+        self.assertEqual(sleep.call_count, 2)
+        self.assertIn("User", PENDING)
+        flush()
+        self.assertEqual(self.reloaded_emails(), ["a@x.com"])
+
+    def test_failed_durable_save_keeps_pending(self):
+        """ A durable save failing to write puts back the records deferred
+        before it, and is itself rolled back
+        """
+        self.new_user("a@x.com")
+        with mock.patch.object(User, "_write_files", FailingWrite()):
+            user = User()
+            user.email = "b@x.com"
+            with self.assertRaises(OSError):
+                user.save(durable=True)
+        self.assertEqual(User.search({"email": "b@x.com"}), [])
+        flush()
+        self.assertEqual(self.reloaded_emails(), ["a@x.com"])
+
+    def test_save_does_not_wait_for_flush(self):
+        """ A save is deferred while the flusher is writing the files
+        """
+        self.new_user("a@x.com")
+        blocked = BlockedWrite()
+        with mock.patch.object(User, "_write_files", blocked):
+            flusher = threading.Thread(target=flush)
+            flusher.start()
+            self.assertTrue(blocked.writing.wait(5))
+            saver = threading.Thread(target=self.new_user,
+                                     args=("b@x.com",))
+            saver.start()
+            saver.join(5)
+            saved = not saver.is_alive()
+            blocked.released.set()
+            flusher.join(5)
+            saver.join(5)
+        self.assertTrue(saved)
+        self.assertEqual([record["obj"]["email"]
+                          for record in PENDING["User"][1]], ["b@x.com"])
+        flush()
+        self.assertEqual(self.reloaded_emails(), ["a@x.com", "b@x.com"])
+
+
+class TestIndexes(StoreTestCase):
+    """ Indexes kept up to date by saves
+    """
+
+    def test_moved_object_found_while_reindexed(self):
+        """ An object whose value changes is already in its new bucket
+        when it leaves the old one
+        """
+        user = self.new_user("a@x.com")
+        found = []
+        leave = Index._leave
+
+        def _leave(index, obj_id, value):
+            found.append([other.id for other in
+                          User.search({"email": "b@x.com"})])
+            leave(index, obj_id, value)
+
+        user.email = "b@x.com"
+        with mock.patch.object(Index, "_leave", _leave):
+            user.save()
+        self.assertEqual(found, [[user.id]])
+        self.assertEqual(User.search({"email": "a@x.com"}), [])
+        self.assertEqual(User.search({"email": "b@x.com"}), [user])
+
+    def test_resaved_object_keeps_bucket(self):
+        """ Saving an object again without changing its value leaves its
+        bucket untouched, so it is found all along
+        """
+        user = self.new_user("a@x.com")
+        index = User._indexes()["email"]
+        bucket = index.lookup("a@x.com")
+        with mock.patch.object(Index, "_leave") as leave:
+            user.save()
+            User.save_many([user])
+        leave.assert_not_called()
+        self.assertIs(index.lookup("a@x.com"), bucket)
+        self.assertEqual(User.search({"email": "a@x.com"}), [user])
+
+
+@mock.patch.object(User, "_persist", side_effect=OSError("disk full"))
+class TestRollback(StoreTestCase):
+    """ Saves and removes failing to persist leave DATA, the indexes and
+    the files as they were
+    """
+
+    def setUp(self):
+        """ Save a user before the failures
+        """
+        super().setUp()
+        with mock.patch.object(User, "_persist", User._persist):
+            self.user = self.new_user("a@x.com")
+        self.store = DATA["User"]
+
+    def assertUnchanged(self):
+        """ Check the previous objects are back, and only the first user
+        is there, in memory and on disk
+        """
+        self.assertIs(DATA["User"], self.store)
+        self.assertEqual(User.count(), 1)
+        self.assertEqual(User.search({"email": "a@x.com"}), [self.user])
+        self.assertEqual(User.search({"email": "b@x.com"}), [])
+        self.assertEqual(User.search({}, prefixes={"email": ""}),
+                         [self.user])
+        self.assertEqual(User.search({}, order_by="-email"), [self.user])
+        self.assertEqual(self.reloaded_emails(), ["a@x.com"])
+
+    def test_failed_save(self, persist):
+        """ A new user failing to save is not stored nor indexed
+        """
+        user = User()
+        user.email = "b@x.com"
+        with self.assertRaises(OSError):
+            user.save()
+        self.assertUnchanged()
+        self.assertIsNone(User.get(user.id))
+
+    def test_failed_save_many(self, persist):
+        """ Users failing to save together are not stored nor indexed
+        """
+        users = [User(email="b@x.com"), User(email="c@x.com")]
+        with self.assertRaises(OSError):
+            User.save_many(users)
+        self.assertUnchanged()
+        self.assertEqual(User.search({"email": "c@x.com"}), [])
+
+    def test_failed_remove(self, persist):
+        """ A user failing to be removed is still stored and indexed
+        """
+        with self.assertRaises(OSError):
+            self.user.remove()
+        self.assertUnchanged()
+        self.assertEqual(User.get(self.user.id).email, "a@x.com")
+
+
+class QueryTests():
+    """ Tests of User.query, mixed in a StoreTestCase per storage engine
+    """
+    USERS = [("1", "ann@a.com", "Ann", "2020-01-01T00:00:00"),
+             ("2", "bob@b.com", "Bob", "2020-01-02T00:00:00"),
+             ("3", "bea@b.com", 5, "2020-01-03T00:00:00"),
+             ("4", "carl@c.com", None, "2020-01-04T00:00:00")]
+
+    def setUp(self):
+        """ Save the users, one of them with a number as first name
+        """
+        super().setUp()
+        users = []
+        for obj_id, email, first_name, created_at in self.USERS:
+            user = User(id=obj_id, created_at=created_at)
+            user.email = email
+            user.first_name = first_name
+            user.password = "pwd"
+            users.append(user)
+        User.save_many(users)
+
+    def ids(self, **options) -> list:
+        """ IDs of the users of a query
+        """
+        return [user.id for user in User.query(**options)]
+
+    def test_prefix(self):
+        """ Only the values starting with the prefix match
+        """
+        self.assertEqual(self.ids(prefixes={"email": "b"},
+                                  order_by="email"), ["3", "2"])
+        self.assertEqual(self.ids(prefixes={"email": "bo"}), ["2"])
+        self.assertEqual(self.ids(prefixes={"email": "z"}), [])
+
+    def test_range(self):
+        """ Bounds are included, and None leaves one open
+        """
+        self.assertEqual(self.ids(ranges={"created_at": (
+            datetime(2020, 1, 2), datetime(2020, 1, 3))},
+            order_by="created_at"), ["2", "3"])
+        self.assertEqual(self.ids(ranges={"created_at": (
+            None, datetime(2020, 1, 1, 12))}), ["1"])
+
+    def test_range_skips_other_types(self):
+        """ A range of strings matches no number nor None
+        """
+        self.assertEqual(self.ids(ranges={"first_name": ("A", "Z")},
+                                  order_by="first_name"), ["1", "2"])
+
+    def test_order_by(self):
+        """ Results are sorted on order_by, descending with a leading -,
+        None first then numbers before strings
+        """
+        self.assertEqual(self.ids(order_by="email"), ["1", "3", "2", "4"])
+        self.assertEqual(self.ids(order_by="-email"), ["4", "2", "3", "1"])
+        self.assertEqual(self.ids(order_by="first_name"),
+                         ["4", "3", "1", "2"])
+        self.assertEqual(self.ids(order_by="-first_name"),
+                         ["2", "1", "3", "4"])
+
+    def test_offset_limit(self):
+        """ offset matches are skipped and at most limit returned
+        """
+        self.assertEqual(self.ids(order_by="email", offset=1, limit=2),
+                         ["3", "2"])
+        self.assertEqual(self.ids(order_by="-created_at", offset=3,
+                                  limit=5), ["1"])
+        self.assertEqual(self.ids(order_by="email", offset=4), [])
+
+    def test_timezone_aware_bounds(self):
+        """ Date bounds with a UTC offset are compared in UTC
+        """
+        from api.v1.app import app
+
+        response = app.test_client().get("/api/v1/users", query_string={
+            "created_after": "2020-01-02T01:00:00+01:00",
+            "created_before": "2020-01-02T19:00:00-05:00",
+            "order_by": "created_at"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([user["id"] for user in response.get_json()],
+                         ["2", "3"])
+
+
+class TestQueryFile(QueryTests, StoreTestCase):
+    """ User.query on the JSON files
+    """
+
+
+class TestQuerySQLite(QueryTests, StoreTestCase):
+    """ User.query on the SQLite storage
+    """
+
+    def setUp(self):
+        """ Use a new SQLite database, opened in the test directory
+        """
+        patch = mock.patch.object(base, "storage", SQLiteStorage(
+            ".db.sqlite3", base.TIMESTAMP_FORMAT))
+        patch.start()
+        self.addCleanup(patch.stop)
+        super().setUp()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,10 +3,13 @@
 """
 import bcrypt
 from db import DB
+from os import getenv
 from sqlalchemy.orm.exc import NoResultFound
 from user import User
 from uuid import uuid4
 
+BCRYPT_ROUNDS = int(getenv("BCRYPT_ROUNDS", 12))
+
 
 def _generate_uuid() -> str:
     """
@@ -15,15 +18,24 @@ def _generate_uuid() -> str:
     return str(uuid4())
 
 
-def _hash_password(password: str) -> bytes:
+def _hash_password(password: str, rounds: int = None) -> bytes:
     """
-    method to hash a password and return the hashed password
+    method to hash a password and return the hashed password,
+    with BCRYPT_ROUNDS as cost unless rounds is given
     """
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt(rounds or BCRYPT_ROUNDS)
     hashed_password = bcrypt.hashpw(password.encode("utf-8"), salt)
     return hashed_password
 
 
+def _needs_rehash(hashed_password: bytes, rounds: int = None) -> bool:
+    """
+    method to check if a hash was made with a lower cost than the
+    configured one, so that rehashing never lowers it
+    """
+    return int(hashed_password.split(b"$")[2]) < (rounds or BCRYPT_ROUNDS)
+
+
 class Auth:
     """Auth class to interact with the authentication database.
     """